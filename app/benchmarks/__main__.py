@@ -0,0 +1,137 @@
+"""
+Нагрузочный стенд: python -m app.benchmarks run --links 1000000 --output result.json
+Сравнение с базовым прогоном: python -m app.benchmarks compare baseline.json result.json
+
+По умолчанию всё локально: SQLite во временном каталоге и кэш в памяти процесса
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+def _configure_environment(database_url: str = None):
+    # настройки читаются при импорте app.config, поэтому до любого импорта приложения
+    if database_url is None:
+        database_url = f"sqlite+aiosqlite:///{os.path.join(tempfile.mkdtemp(prefix='shorturler-bench-'), 'bench.db')}"
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.setdefault("CACHE_BACKEND", "memory")
+    os.environ["DB_STATS_HEADERS"] = "true"
+
+async def _run(args) -> dict:
+    import sqlalchemy
+    from httpx import AsyncClient
+
+    from app.benchmarks.workload import SCENARIOS, BenchmarkConfig, run_benchmark
+    from app.config import settings
+    from app.database import SessionLocal, engine
+    from app.main import app
+    from app.utils.cache import get_cache, local_cache
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        raise SystemExit(f"Неизвестные сценарии: {', '.join(unknown)}. Доступны: {', '.join(SCENARIOS)}")
+    config = BenchmarkConfig(
+        links=args.links,
+        requests=args.requests,
+        concurrency=args.concurrency,
+        zipf_s=args.zipf_s,
+        scenarios=scenarios,
+        seed=args.seed
+    )
+
+    async def on_scenario(scenario):
+        print(f"Сценарий {scenario.name}...", file=sys.stderr)
+        if scenario.cold:
+            await get_cache().flush()
+            local_cache.clear()
+
+    async def evict(short_code):
+        # со Zipf популярные ключи иначе вернулись бы в кэш за первые же запросы
+        local_cache.pop(short_code)
+        await get_cache().delete(short_code)
+
+    await app.router.startup()
+    try:
+        async with AsyncClient(app=app, base_url="http://bench") as client:
+            report = await run_benchmark(client, SessionLocal, config, on_scenario=on_scenario, evict=evict)
+    finally:
+        await app.router.shutdown()
+        await engine.dispose()
+
+    report["meta"] = {
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "sqlalchemy": sqlalchemy.__version__,
+        "database": engine.dialect.name,
+        "cache_backend": settings.CACHE_BACKEND,
+    }
+    return report
+
+def _print_summary(report: dict):
+    print(f"{'scenario':<16}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'db q/req':>10}{'errors':>8}",
+          file=sys.stderr)
+    for name, result in report["scenarios"].items():
+        print(
+            f"{name:<16}{result['throughput_rps']:>10}{result['p50_ms']:>10}{result['p95_ms']:>10}"
+            f"{result['p99_ms']:>10}{str(result['db_queries_per_request']):>10}{result['errors']:>8}",
+            file=sys.stderr
+        )
+
+def _report_regressions(baseline_path: str, report: dict, tolerance: float) -> int:
+    from app.benchmarks.compare import compare_reports
+
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    regressions = compare_reports(baseline, report, tolerance)
+    for regression in regressions:
+        print(f"РЕГРЕССИЯ {regression}", file=sys.stderr)
+    if not regressions:
+        print(f"Регрессий относительно {baseline_path} нет (допуск {tolerance:.0%})", file=sys.stderr)
+    return 1 if regressions else 0
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="залить ссылки и прогнать сценарии")
+    run.add_argument("--links", type=int, default=100_000)
+    run.add_argument("--requests", type=int, default=10_000, help="запросов на сценарий")
+    run.add_argument("--concurrency", type=int, default=32)
+    run.add_argument("--zipf-s", type=float, default=1.1)
+    run.add_argument("--scenarios", default="redirect_hot,redirect_cold,mixed,write_heavy")
+    run.add_argument("--seed", type=int, default=42)
+    run.add_argument("--database-url", help="по умолчанию временная SQLite")
+    run.add_argument("--output", default="-", help="файл для JSON-отчёта, '-' — stdout")
+    run.add_argument("--baseline", help="сравнить с сохранённым отчётом")
+    run.add_argument("--tolerance", type=float, default=0.1)
+
+    compare = commands.add_parser("compare", help="сравнить два отчёта")
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    compare.add_argument("--tolerance", type=float, default=0.1)
+
+    args = parser.parse_args(argv)
+    if args.command == "compare":
+        with open(args.current) as f:
+            return _report_regressions(args.baseline, json.load(f), args.tolerance)
+
+    _configure_environment(args.database_url)
+    report = asyncio.run(_run(args))
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output == "-":
+        print(output)
+    else:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    _print_summary(report)
+    if args.baseline:
+        return _report_regressions(args.baseline, report, args.tolerance)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
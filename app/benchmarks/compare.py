@@ -0,0 +1,50 @@
+from typing import List
+
+# (метрика, True если рост — это ухудшение)
+SCENARIO_METRICS = (
+    ("throughput_rps", False),
+    ("p50_ms", True),
+    ("p95_ms", True),
+    ("p99_ms", True),
+    ("db_queries_per_request", True),
+)
+OPERATION_METRICS = (
+    ("p99_ms", True),
+    ("db_queries_per_request", True),
+)
+# разница меньше этой в абсолютных единицах — шум, а не регрессия
+ABSOLUTE_NOISE = {"p50_ms": 0.5, "p95_ms": 1.0, "p99_ms": 2.0, "db_queries_per_request": 0.05, "throughput_rps": 5.0}
+
+def _check(path: str, metric: str, higher_is_worse: bool, baseline: dict, current: dict, tolerance: float) -> List[str]:
+    old, new = baseline.get(metric), current.get(metric)
+    if old is None or new is None:
+        return []
+    delta = new - old if higher_is_worse else old - new
+    if delta <= ABSOLUTE_NOISE.get(metric, 0.0) or delta <= abs(old) * tolerance:
+        return []
+    change = (new - old) / old * 100 if old else float("inf")
+    return [f"{path}.{metric}: {old} -> {new} ({change:+.1f}%)"]
+
+def compare_reports(baseline: dict, current: dict, tolerance: float = 0.1) -> List[str]:
+    """
+    Регрессии current относительно baseline больше чем на tolerance (доля).
+    Сценарии и операции, которых нет в одном из отчётов, пропускаются
+    """
+    regressions = []
+    for name, old_scenario in baseline.get("scenarios", {}).items():
+        new_scenario = current.get("scenarios", {}).get(name)
+        if new_scenario is None:
+            continue
+        for metric, higher_is_worse in SCENARIO_METRICS:
+            regressions += _check(name, metric, higher_is_worse, old_scenario, new_scenario, tolerance)
+        for operation, old_operation in old_scenario.get("operations", {}).items():
+            new_operation = new_scenario.get("operations", {}).get(operation)
+            if new_operation is None:
+                continue
+            for metric, higher_is_worse in OPERATION_METRICS:
+                regressions += _check(
+                    f"{name}.{operation}", metric, higher_is_worse, old_operation, new_operation, tolerance
+                )
+        if new_scenario.get("errors", 0) > old_scenario.get("errors", 0):
+            regressions.append(f"{name}.errors: {old_scenario.get('errors', 0)} -> {new_scenario['errors']}")
+    return regressions
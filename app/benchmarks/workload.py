@@ -0,0 +1,224 @@
+import asyncio
+import bisect
+import itertools
+import math
+import random
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from httpx import AsyncClient
+from sqlalchemy import insert
+
+from app import models
+from app.utils.bloom import short_code_filter
+from app.utils.shortcode import ShortCodeAllocator, short_code_encoder
+from app.utils.urls import url_hash
+
+@dataclass
+class Scenario:
+    name: str
+    # доля каждой операции в потоке запросов
+    mix: Dict[str, float]
+    # каждый переход идёт мимо кэша: ключ вытесняется перед запросом (проверка поведения на промахах)
+    cold: bool = False
+
+SCENARIOS = {
+    scenario.name: scenario for scenario in (
+        Scenario("redirect_hot", {"redirect": 1.0}),
+        Scenario("redirect_cold", {"redirect": 1.0}, cold=True),
+        Scenario("mixed", {
+            "redirect": 0.85, "stats": 0.05, "create": 0.03, "update": 0.02, "search": 0.03, "redirect_missing": 0.02
+        }),
+        Scenario("write_heavy", {"create": 0.5, "update": 0.3, "redirect": 0.2}),
+    )
+}
+
+@dataclass
+class BenchmarkConfig:
+    links: int = 100_000
+    requests: int = 10_000
+    concurrency: int = 32
+    zipf_s: float = 1.1
+    scenarios: List[str] = field(default_factory=lambda: list(SCENARIOS))
+    seed: int = 42
+
+class ZipfSampler:
+    """
+    Ранги 0..n-1 с вероятностью ~ 1 / (rank + 1)^s: немного очень популярных ссылок и длинный хвост
+    """
+    def __init__(self, n: int, s: float, rng: random.Random):
+        self.rng = rng
+        self._cdf = list(itertools.accumulate(1.0 / (rank + 1) ** s for rank in range(n)))
+
+    def sample(self) -> int:
+        return bisect.bisect_left(self._cdf, self.rng.random() * self._cdf[-1])
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    # nearest-rank
+    index = max(math.ceil(q / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+def summarize(latencies: List[float], queries: List[int], errors: int, duration: Optional[float] = None) -> dict:
+    ordered = sorted(latencies)
+    summary = {
+        "requests": len(ordered),
+        "errors": errors,
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3) if ordered else 0.0,
+        "p50_ms": round(percentile(ordered, 50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 3),
+        "db_queries_per_request": round(sum(queries) / len(queries), 3) if queries else None,
+    }
+    if duration is not None:
+        summary["duration_s"] = round(duration, 3)
+        summary["throughput_rps"] = round(len(ordered) / duration, 1) if duration else 0.0
+    return summary
+
+async def seed_links(session_factory, count: int, owner_id: int, chunk_size: int = 10_000) -> List[Tuple[str, str]]:
+    """
+    Заливает count ссылок пачками мимо API. id берутся из общего счётчика кодов,
+    поэтому с ссылками, созданными через API, они не пересекаются.
+    Возвращает (short_code, original_url)
+    """
+    allocator = ShortCodeAllocator(block_size=count)
+    now = datetime.now(timezone.utc)
+    table = models.Link.__table__
+    links = []
+    async with session_factory() as db:
+        ids = await allocator.allocate_many(db, count)
+        for start in range(0, count, chunk_size):
+            rows = []
+            for code_id in ids[start:start + chunk_size]:
+                original_url = f"https://example.com/bench/{code_id}"
+                rows.append({
+                    "short_code": short_code_encoder.encode(code_id),
+                    "original_url": original_url,
+                    "url_hash": url_hash(original_url),
+                    "owner_id": owner_id,
+                    "created_at": now,
+                    "redirect_count": 0,
+                })
+            await db.execute(insert(table), rows)
+            await db.commit()
+            links.extend((row["short_code"], row["original_url"]) for row in rows)
+    # иначе при включённом Bloom-фильтре все переходы на залитые ссылки получат 404
+    for short_code, _ in links:
+        short_code_filter.add(short_code)
+    return links
+
+class WorkloadRunner:
+    def __init__(
+        self, client: AsyncClient, links: List[Tuple[str, str]], token: str, config: BenchmarkConfig, evict=None
+    ):
+        self.client = client
+        self.evict = evict
+        self.links = links
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.zipf = ZipfSampler(len(links), config.zipf_s, self.rng)
+
+    def _popular_code(self) -> str:
+        return self.links[self.zipf.sample()][0]
+
+    async def _request(self, operation: str, cold: bool = False):
+        if operation == "redirect":
+            short_code = self._popular_code()
+            if cold and self.evict is not None:
+                await self.evict(short_code)
+            return await self.client.get(f"/links/{short_code}", follow_redirects=False), (307,)
+        if operation == "redirect_missing":
+            return await self.client.get(f"/links/missing-{uuid.uuid4().hex[:12]}", follow_redirects=False), (404,)
+        if operation == "stats":
+            return await self.client.get(f"/links/{self._popular_code()}/stats"), (200,)
+        if operation == "search":
+            original_url = self.links[self.zipf.sample()][1]
+            return await self.client.get("/links/search", params={"original_url": original_url}), (200, 404)
+        if operation == "create":
+            payload = {"original_url": f"https://example.com/new/{uuid.uuid4().hex}"}
+            return await self.client.post("/links/shorten", json=payload, headers=self.headers), (200,)
+        if operation == "update":
+            payload = {"original_url": f"https://example.com/updated/{uuid.uuid4().hex}"}
+            return await self.client.put(f"/links/{self._popular_code()}", json=payload, headers=self.headers), (200,)
+        raise ValueError(f"Неизвестная операция: {operation}")
+
+    async def run(self, scenario: Scenario) -> dict:
+        operations = list(scenario.mix)
+        weights = [scenario.mix[operation] for operation in operations]
+        plan = self.rng.choices(operations, weights=weights, k=self.config.requests)
+        latencies: Dict[str, List[float]] = {operation: [] for operation in operations}
+        queries: Dict[str, List[int]] = {operation: [] for operation in operations}
+        errors: Dict[str, int] = {operation: 0 for operation in operations}
+        queue = iter(plan)
+
+        async def worker():
+            for operation in queue:
+                started = time.perf_counter()
+                response, expected = await self._request(operation, scenario.cold)
+                latencies[operation].append(time.perf_counter() - started)
+                if response.status_code not in expected:
+                    errors[operation] += 1
+                # у ответов быстрого пути заголовка нет: база не использовалась
+                queries[operation].append(int(response.headers.get("x-db-queries", 0)))
+
+        started = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(self.config.concurrency)])
+        duration = time.perf_counter() - started
+
+        report = summarize(
+            [value for values in latencies.values() for value in values],
+            [value for values in queries.values() for value in values],
+            sum(errors.values()),
+            duration
+        )
+        report["operations"] = {
+            operation: summarize(latencies[operation], queries[operation], errors[operation])
+            for operation in operations if latencies[operation]
+        }
+        return report
+
+async def run_benchmark(
+    client: AsyncClient, session_factory, config: BenchmarkConfig, on_scenario=None, evict=None
+) -> dict:
+    """
+    Заводит пользователя, заливает ссылки и прогоняет сценарии. on_scenario(scenario) вызывается
+    перед каждым сценарием (например, чтобы сбросить кэш), evict(short_code) — перед каждым
+    переходом холодного сценария.
+    Число запросов к базе берётся из заголовка X-DB-Queries, нужен DB_STATS_HEADERS
+    """
+    username, password = f"bench-{uuid.uuid4().hex[:8]}", uuid.uuid4().hex
+    response = await client.post("/auth/register", json={"username": username, "password": password})
+    response.raise_for_status()
+    owner_id = response.json()["id"]
+    response = await client.post("/auth/token", data={"username": username, "password": password})
+    response.raise_for_status()
+    token = response.json()["access_token"]
+
+    started = time.perf_counter()
+    links = await seed_links(session_factory, config.links, owner_id)
+    seed_seconds = time.perf_counter() - started
+
+    runner = WorkloadRunner(client, links, token, config, evict=evict)
+    results = {}
+    for name in config.scenarios:
+        scenario = SCENARIOS[name]
+        if on_scenario is not None:
+            await on_scenario(scenario)
+        results[name] = await runner.run(scenario)
+    return {
+        "config": {
+            "links": config.links,
+            "requests": config.requests,
+            "concurrency": config.concurrency,
+            "zipf_s": config.zipf_s,
+            "seed": config.seed,
+        },
+        "seed_seconds": round(seed_seconds, 3),
+        "seed_rows_per_second": round(config.links / seed_seconds, 1) if seed_seconds else 0.0,
+        "scenarios": results,
+    }
@@ -1,15 +1,25 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import bindparam, delete, insert, select, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime, timezone
-import random
-import string
 import hashlib
+from typing import List
 
 from app import models, schemas
+from app.utils.bloom import short_code_filter
+from app.utils.cache import as_utc
+from app.utils.hll import HyperLogLog
+from app.utils.shortcode import short_code_allocator, short_code_encoder
+from app.utils.tracing import traced
+from app.utils.urls import url_hash
+
+GENERATED_CODE_ATTEMPTS = 3
 
 def get_password_hash(password: str) -> str:
     return hashlib.sha256(password.encode()).hexdigest()
 
+@traced()
 async def create_user(db: AsyncSession, user: schemas.UserCreate):
     hashed_password = get_password_hash(user.password)
     db_user = models.User(
@@ -21,55 +31,313 @@ async def create_user(db: AsyncSession, user: schemas.UserCreate):
     await db.refresh(db_user)
     return db_user
 
-async def get_user_by_username(db: AsyncSession, username: str):
-    stmt = select(models.User).where(models.User.username == username)
+@traced()
+async def get_user_by_username(db: AsyncSession, username: str, use_replica: bool = True):
+    stmt = select(models.User).where(models.User.username == username).execution_options(read_replica=use_replica)
     result = await db.execute(stmt)
     return result.scalars().first()
 
-def generate_short_code(custom_alias: str = None) -> str:
+@traced()
+async def get_user_by_id(db: AsyncSession, user_id: int):
+    return await db.get(models.User, user_id)
+
+@traced()
+async def change_user_password(db: AsyncSession, db_user: models.User, new_password: str):
+    db_user.hashed_password = get_password_hash(new_password)
+    db_user.token_version = (db_user.token_version or 0) + 1
+    await db.commit()
+    await db.refresh(db_user)
+    return db_user
+
+@traced()
+async def delete_user(db: AsyncSession, db_user: models.User):
+    await db.execute(
+        update(models.Link).where(models.Link.owner_id == db_user.id).values(owner_id=None)
+    )
+    await db.delete(db_user)
+    await db.commit()
+
+def generate_short_code(custom_alias: str = None, code_id: int = None) -> str:
     if custom_alias:
         return custom_alias
-    prefix = "hse"
-    random_part = ''.join(random.choices(string.ascii_letters + string.digits, k=6))
-    return prefix + random_part
+    return short_code_encoder.encode(code_id)
 
+@traced()
 async def create_link(db: AsyncSession, link: schemas.LinkCreate, owner_id: int = None):
-    short_code = generate_short_code(link.custom_alias)
-    db_link = models.Link(
-        original_url=link.original_url,
-        short_code=short_code,
-        expires_at=link.expires_at,
-        owner_id=owner_id
-    )
-    db.add(db_link)
-    await db.commit()
+    for attempt in range(GENERATED_CODE_ATTEMPTS):
+        code_id = None if link.custom_alias else await short_code_allocator.allocate(db)
+        db_link = models.Link(
+            original_url=link.original_url,
+            url_hash=url_hash(link.original_url),
+            short_code=generate_short_code(link.custom_alias, code_id),
+            expires_at=link.expires_at,
+            owner_id=owner_id
+        )
+        db.add(db_link)
+        try:
+            await db.commit()
+            break
+        except IntegrityError:
+            await db.rollback()
+            # сгенерированный код мог совпасть только со старым случайным кодом — берём следующий id
+            if link.custom_alias or attempt == GENERATED_CODE_ATTEMPTS - 1:
+                raise
     await db.refresh(db_link)
+    short_code_filter.add(db_link.short_code)
     return db_link
 
-async def get_link_by_short_code(db: AsyncSession, short_code: str):
-    stmt = select(models.Link).where(models.Link.short_code == short_code)
+def _insert_ignoring_conflicts(db: AsyncSession, table):
+    """
+    INSERT, пропускающий занятые short_code, или None, если диалект так не умеет
+    """
+    dialect = db.bind.dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(table).on_conflict_do_nothing(index_elements=["short_code"])
+    if dialect == "sqlite":
+        return sqlite.insert(table).on_conflict_do_nothing(index_elements=["short_code"])
+    return None
+
+async def _insert_links_one_by_one(db: AsyncSession, table, rows) -> List[str]:
+    """
+    Запасной путь без ON CONFLICT: каждая строка в своём SAVEPOINT, конфликт откатывает только её.
+    Возвращает коды вставленных строк
+    """
+    inserted = []
+    for row in rows:
+        try:
+            async with db.begin_nested():
+                await db.execute(insert(table).values(row))
+        except IntegrityError:
+            continue
+        inserted.append(row["short_code"])
+    return inserted
+
+async def _insert_links(db: AsyncSession, rows) -> dict:
+    """
+    Вставляет строки ссылок, пропуская занятые short_code. Возвращает {short_code: вставленная строка}
+    """
+    table = models.Link.__table__
+    stmt = _insert_ignoring_conflicts(db, table)
+    codes = [row["short_code"] for row in rows]
+    if stmt is None:
+        codes = await _insert_links_one_by_one(db, table, rows)
+        if not codes:
+            return {}
+        inserted = (await db.execute(select(table).where(table.c.short_code.in_(codes)))).all()
+        return {row.short_code: row for row in inserted}
+    stmt = stmt.values(rows)
+    if db.bind.dialect.implicit_returning:
+        inserted = (await db.execute(stmt.returning(*table.c))).all()
+        return {row.short_code: row for row in inserted}
+    await db.execute(stmt)
+    # без RETURNING чужая строка с тем же кодом отличается URL, владельцем или временем создания
+    ours = {row["short_code"]: (row["original_url"], row["owner_id"], as_utc(row["created_at"])) for row in rows}
+    inserted = (await db.execute(select(table).where(table.c.short_code.in_(codes)))).all()
+    return {
+        row.short_code: row for row in inserted
+        if ours[row.short_code] == (row.original_url, row.owner_id, as_utc(row.created_at))
+    }
+
+@traced()
+async def create_links_batch(db: AsyncSession, links, owner_id: int = None):
+    """
+    Создаёт пачку ссылок одним многострочным INSERT в одной транзакции. Элементы, чей
+    сгенерированный код оказался занят, повторяются с новыми кодами следующими транзакциями.
+    Возвращает список (строка ссылки или None, причина отказа) в порядке входа
+    """
+    results = [(None, None)] * len(links)
+    aliases = {link.custom_alias for link in links if link.custom_alias}
+    taken = set()
+    if aliases:
+        stmt = select(models.Link.short_code).where(models.Link.short_code.in_(aliases))
+        taken = set((await db.execute(stmt)).scalars().all())
+
+    pending = []
+    for index, link in enumerate(links):
+        alias = link.custom_alias
+        if alias and short_code_encoder.is_generated(alias):
+            results[index] = (None, "Алиас совпадает с форматом автоматически сгенерированных кодов")
+        elif alias and alias in taken:
+            results[index] = (None, "Алиас уже занят")
+        else:
+            if alias:
+                taken.add(alias)
+            pending.append(index)
+
+    for attempt in range(GENERATED_CODE_ATTEMPTS):
+        if not pending:
+            break
+        # резерв кодов коммитится сам, поэтому до вставки
+        code_ids = iter(await short_code_allocator.allocate_many(
+            db, sum(1 for index in pending if not links[index].custom_alias)
+        ))
+        now = datetime.now(timezone.utc)
+        rows = []
+        for index in pending:
+            link = links[index]
+            rows.append({
+                "original_url": link.original_url,
+                "url_hash": url_hash(link.original_url),
+                "short_code": generate_short_code(link.custom_alias, None if link.custom_alias else next(code_ids)),
+                "expires_at": link.expires_at,
+                "owner_id": owner_id,
+                "created_at": now,
+                "redirect_count": 0
+            })
+        inserted = await _insert_links(db, rows)
+        await db.commit()
+
+        retry = []
+        for index, row in zip(pending, rows):
+            created = inserted.get(row["short_code"])
+            if created is not None:
+                short_code_filter.add(created.short_code)
+                results[index] = (created, None)
+            elif links[index].custom_alias:
+                results[index] = (None, "Алиас уже занят")
+            elif attempt == GENERATED_CODE_ATTEMPTS - 1:
+                results[index] = (None, "Не удалось подобрать свободный короткий код")
+            else:
+                # сгенерированный код мог совпасть только со старым случайным кодом — берём следующий id
+                retry.append(index)
+        pending = retry
+    return results
+
+IMPORT_COLUMNS = ("original_url", "url_hash", "short_code", "expires_at", "owner_id", "created_at", "redirect_count")
+
+@traced()
+async def get_taken_short_codes(db: AsyncSession, short_codes) -> set:
+    if not short_codes:
+        return set()
+    stmt = select(models.Link.short_code).where(models.Link.short_code.in_(short_codes))
+    return set((await db.execute(stmt)).scalars().all())
+
+async def _copy_links(db: AsyncSession, rows) -> List[str]:
+    """
+    COPY в временную таблицу и оттуда INSERT ... ON CONFLICT DO NOTHING: занятые коды не роняют пачку
+    """
+    # первый запрос через сессию открывает транзакцию, COPY по тому же соединению идёт в ней же
+    await db.execute(text(
+        "CREATE TEMP TABLE IF NOT EXISTS links_import ON COMMIT DELETE ROWS AS "
+        f"SELECT {', '.join(IMPORT_COLUMNS)} FROM links WITH NO DATA"
+    ))
+    raw = await (await db.connection()).get_raw_connection()
+    await raw.driver_connection.copy_records_to_table(
+        "links_import",
+        records=[tuple(row[name] for name in IMPORT_COLUMNS) for row in rows],
+        columns=IMPORT_COLUMNS
+    )
+    columns = ", ".join(IMPORT_COLUMNS)
+    result = await db.execute(text(
+        f"INSERT INTO links ({columns}) SELECT {columns} FROM links_import "
+        "ON CONFLICT (short_code) DO NOTHING RETURNING short_code"
+    ))
+    return list(result.scalars().all())
+
+@traced()
+async def bulk_insert_links(db: AsyncSession, rows) -> List[str]:
+    """
+    Загрузка пачки ссылок самым быстрым путём бэкенда: COPY для PostgreSQL (asyncpg),
+    executemany для остальных, построчно — для диалектов без ON CONFLICT. Без commit — вызывающий фиксирует пачку вместе с чекпоинтом.
+    Возвращает коды, которые действительно вставлены
+    """
+    if not rows:
+        return []
+    if db.bind.dialect.name == "postgresql" and db.bind.dialect.driver == "asyncpg":
+        return await _copy_links(db, rows)
+    table = models.Link.__table__
+    stmt = _insert_ignoring_conflicts(db, table)
+    if stmt is None:
+        return await _insert_links_one_by_one(db, table, rows)
+    result = await db.execute(stmt, list(rows))
+    codes = [row["short_code"] for row in rows]
+    if result.rowcount == len(rows):
+        return codes
+    # часть строк пропущена из-за занятых кодов: наши — те, что совпадают по URL, владельцу и времени создания
+    ours = {row["short_code"]: (row["original_url"], row["owner_id"], as_utc(row["created_at"])) for row in rows}
+    stmt = (
+        select(table.c.short_code, table.c.original_url, table.c.owner_id, table.c.created_at)
+        .where(table.c.short_code.in_(codes))
+    )
+    return [
+        code for code, original_url, owner_id, created_at in (await db.execute(stmt)).all()
+        if ours[code] == (original_url, owner_id, as_utc(created_at))
+    ]
+
+@traced()
+async def get_import_checkpoint(db: AsyncSession, job_id: str):
+    return await db.get(models.ImportCheckpoint, job_id)
+
+@traced()
+async def save_import_checkpoint(
+    db: AsyncSession,
+    job_id: str,
+    source: str,
+    records_done: int,
+    rows_imported: int,
+    rows_rejected: int,
+    finished: bool = False
+):
+    """
+    Без commit: чекпоинт фиксируется в одной транзакции с загруженной пачкой
+    """
+    table = models.ImportCheckpoint.__table__
+    now = datetime.now(timezone.utc)
+    values = {
+        "source": source,
+        "records_done": records_done,
+        "rows_imported": rows_imported,
+        "rows_rejected": rows_rejected,
+        "updated_at": now,
+        "finished_at": now if finished else None,
+    }
+    result = await db.execute(update(table).where(table.c.job_id == job_id).values(**values))
+    if not result.rowcount:
+        await db.execute(insert(table).values(job_id=job_id, **values))
+
+@traced()
+async def get_link_by_short_code(db: AsyncSession, short_code: str, use_replica: bool = True):
+    """
+    use_replica=False — перед изменением ссылки читаем с primary, реплика может отставать
+    """
+    stmt = select(models.Link).where(models.Link.short_code == short_code).execution_options(read_replica=use_replica)
     result = await db.execute(stmt)
     return result.scalars().first()
 
+async def _delete_click_stats(db: AsyncSession, short_codes):
+    """
+    Статистика ключуется по short_code, поэтому удаляется вместе со ссылкой:
+    иначе заново созданный алиас унаследует чужие клики
+    """
+    for model in (models.ClickEvent, models.ClickRollup, models.VisitorSketch):
+        table = model.__table__
+        await db.execute(delete(table).where(table.c.short_code.in_(short_codes)))
+
+@traced()
 async def delete_link(db: AsyncSession, short_code: str):
-    db_link = await get_link_by_short_code(db, short_code)
+    db_link = await get_link_by_short_code(db, short_code, use_replica=False)
     if db_link:
         await db.delete(db_link)
+        await _delete_click_stats(db, [short_code])
         await db.commit()
+        short_code_filter.remove(short_code)
         return db_link
     return None
 
+@traced()
 async def update_link(db: AsyncSession, short_code: str, link_update: schemas.LinkUpdate):
-    db_link = await get_link_by_short_code(db, short_code)
+    db_link = await get_link_by_short_code(db, short_code, use_replica=False)
     if db_link:
         if link_update.original_url is not None:
             db_link.original_url = link_update.original_url
+            db_link.url_hash = url_hash(link_update.original_url)
         if link_update.expires_at is not None:
             db_link.expires_at = link_update.expires_at
         await db.commit()
         await db.refresh(db_link)
     return db_link
 
+@traced()
 async def increment_redirect_count(db: AsyncSession, db_link: models.Link):
     db_link.redirect_count += 1
     db_link.last_accessed_at = datetime.now(timezone.utc)
@@ -77,7 +345,289 @@ async def increment_redirect_count(db: AsyncSession, db_link: models.Link):
     await db.refresh(db_link)
     return db_link
 
-async def search_link_by_original_url(db: AsyncSession, original_url: str):
-    stmt = select(models.Link).where(models.Link.original_url == original_url)
+@traced()
+async def get_links_by_owner(db: AsyncSession, owner_id: int, limit: int, after_id: int = None):
+    """
+    Ссылки пользователя по индексу (owner_id, id) с keyset-пагинацией
+    """
+    stmt = (
+        select(models.Link)
+        .where(models.Link.owner_id == owner_id)
+        .order_by(models.Link.id)
+        .limit(limit)
+        .execution_options(read_replica=True)
+    )
+    if after_id is not None:
+        stmt = stmt.where(models.Link.id > after_id)
+    return (await db.execute(stmt)).scalars().all()
+
+EXPORT_COLUMNS = ("short_code", "original_url", "created_at", "expires_at", "redirect_count", "last_accessed_at")
+
+async def stream_links_by_owner(db: AsyncSession, owner_id: int, chunk_size: int):
+    """
+    Все ссылки пользователя пачками по chunk_size строк через серверный курсор:
+    память не зависит от числа ссылок. Строки — только колонки EXPORT_COLUMNS, без ORM-объектов
+    """
+    links = models.Link.__table__
+    stmt = (
+        select(*(links.c[name] for name in EXPORT_COLUMNS))
+        .where(links.c.owner_id == owner_id)
+        .order_by(links.c.id)
+        .execution_options(yield_per=chunk_size, read_replica=True)
+    )
+    result = await db.stream(stmt)
+    async for partition in result.mappings().partitions(chunk_size):
+        yield partition
+
+@traced()
+async def get_links_for_warmup(db: AsyncSession, limit: int):
+    """
+    Недавно открытые неистёкшие ссылки для прогрева кэша, по частичному индексу ix_links_last_accessed_at.
+    Читаем с primary: снимок с отстающей реплики может вернуть уже удалённые ссылки
+    """
+    links = models.Link
+    stmt = (
+        select(links)
+        .where(links.last_accessed_at.isnot(None))
+        .where((links.expires_at.is_(None)) | (links.expires_at > datetime.now(timezone.utc)))
+        .order_by(links.last_accessed_at.desc(), links.id.desc())
+        .limit(limit)
+    )
+    return (await db.execute(stmt)).scalars().all()
+
+@traced()
+async def delete_expired_links(db: AsyncSession, expired_before: datetime, limit: int):
+    """
+    Удаляет до limit ссылок, истёкших раньше expired_before, короткой транзакцией.
+    Условие совпадает с предикатом частичного индекса ix_links_expires_at.
+    Статистика удалённых ссылок удаляется в той же транзакции. Возвращает удалённые short_code
+    """
+    links = models.Link.__table__
+    stmt = (
+        select(links.c.id, links.c.short_code)
+        .where(links.c.expires_at.isnot(None), links.c.expires_at < expired_before)
+        .order_by(links.c.expires_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    rows = (await db.execute(stmt)).all()
+    if rows:
+        await db.execute(delete(links).where(links.c.id.in_([row.id for row in rows])))
+        await _delete_click_stats(db, [row.short_code for row in rows])
+    await db.commit()
+    return [row.short_code for row in rows]
+
+@traced()
+async def apply_redirect_deltas(db: AsyncSession, deltas):
+    """
+    deltas: список (short_code, прирост, last_accessed_at), один executemany на всю пачку
+    """
+    if not deltas:
+        return
+    links = models.Link.__table__
+    stmt = (
+        update(links)
+        .where(links.c.short_code == bindparam("b_short_code"))
+        .values(
+            redirect_count=links.c.redirect_count + bindparam("b_delta"),
+            last_accessed_at=bindparam("b_accessed_at")
+        )
+    )
+    await db.execute(stmt, [
+        {"b_short_code": short_code, "b_delta": delta, "b_accessed_at": accessed_at}
+        for short_code, delta, accessed_at in deltas
+    ])
+    await db.commit()
+
+def _dialect_insert(db: AsyncSession, table):
+    """
+    INSERT с ON CONFLICT, если диалект его умеет, иначе None
+    """
+    dialect = db.bind.dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(table)
+    if dialect == "sqlite":
+        return sqlite.insert(table)
+    return None
+
+def _key(row: dict, key_columns) -> tuple:
+    return tuple(as_utc(row[name]) if isinstance(row[name], datetime) else row[name] for name in key_columns)
+
+async def _lock_existing_keys(db: AsyncSession, table, key_columns, rows) -> set:
+    """
+    Ключи rows, уже лежащие в таблице; строки блокируются в порядке ключа, как и при upsert
+    """
+    columns = [table.c[name] for name in key_columns]
+    stmt = (
+        select(*columns)
+        .where(*(column.in_({row[column.name] for row in rows}) for column in columns))
+        .order_by(*columns)
+        .with_for_update()
+    )
+    wanted = {_key(row, key_columns) for row in rows}
+    found = {_key(dict(zip(key_columns, values)), key_columns) for values in (await db.execute(stmt)).all()}
+    return found & wanted
+
+ROLLUP_KEY = ("short_code", "granularity", "bucket")
+
+async def _upsert_click_rollups(db: AsyncSession, rows):
+    """
+    Прибавляет clicks к свёрткам. Строки идут в порядке ключа: воркеры с пересекающимися
+    пачками блокируют их в одном порядке и не попадают в deadlock
+    """
+    table = models.ClickRollup.__table__
+    rows = sorted(rows, key=lambda row: _key(row, ROLLUP_KEY))
+    stmt = _dialect_insert(db, table)
+    if stmt is not None:
+        await db.execute(stmt.on_conflict_do_update(
+            index_elements=list(ROLLUP_KEY),
+            set_={"clicks": table.c.clicks + stmt.excluded.clicks}
+        ), rows)
+        return
+    # без upsert: прибавляем к существующим под блокировкой, остальные вставляем.
+    # Если ту же строку одновременно вставил другой воркер, пачка упадёт и повторится при следующем проходе
+    existing = await _lock_existing_keys(db, table, ROLLUP_KEY, rows)
+    to_update = [row for row in rows if _key(row, ROLLUP_KEY) in existing]
+    to_insert = [row for row in rows if _key(row, ROLLUP_KEY) not in existing]
+    if to_update:
+        await db.execute(
+            update(table)
+            .where(*(table.c[name] == bindparam(f"b_{name}") for name in ROLLUP_KEY))
+            .values(clicks=table.c.clicks + bindparam("b_clicks")),
+            [{f"b_{name}": value for name, value in row.items()} for row in to_update]
+        )
+    if to_insert:
+        await db.execute(insert(table), to_insert)
+
+SKETCH_KEY = ("short_code", "day")
+
+@traced()
+async def _merge_visitor_sketches(db: AsyncSession, sketches):
+    """
+    Вливает скетчи {(short_code, day): HyperLogLog} в сохранённые. Строки блокируются
+    до конца транзакции в порядке ключа, поэтому воркеры не затирают вклад друг друга
+    и не блокируют друг друга крест-накрест
+    """
+    table = models.VisitorSketch.__table__
+    empty = HyperLogLog().to_bytes()
+    rows = [{"short_code": short_code, "day": day, "registers": empty} for short_code, day in sorted(sketches)]
+    insert_stmt = _dialect_insert(db, table)
+    if insert_stmt is not None:
+        await db.execute(insert_stmt.on_conflict_do_nothing(), rows)
+    else:
+        existing = await _lock_existing_keys(db, table, SKETCH_KEY, rows)
+        missing = [row for row in rows if _key(row, SKETCH_KEY) not in existing]
+        if missing:
+            await db.execute(insert(table), missing)
+    stmt = (
+        select(table.c.short_code, table.c.day, table.c.registers)
+        .where(
+            table.c.short_code.in_({short_code for short_code, _ in sketches}),
+            table.c.day.in_({day for _, day in sketches})
+        )
+        .order_by(table.c.short_code, table.c.day)
+        .with_for_update()
+    )
+    updates = []
+    for short_code, day, registers in (await db.execute(stmt)).all():
+        sketch = sketches.get((short_code, as_utc(day)))
+        if sketch is None:
+            continue
+        merged = HyperLogLog(sketch.precision, registers).merge(sketch)
+        updates.append({"b_short_code": short_code, "b_day": day, "b_registers": merged.to_bytes()})
+    await db.execute(
+        update(table)
+        .where(table.c.short_code == bindparam("b_short_code"), table.c.day == bindparam("b_day"))
+        .values(registers=bindparam("b_registers")),
+        updates
+    )
+
+@traced()
+async def store_click_events(db: AsyncSession, events, rollups, sketches=None):
+    """
+    events: список (short_code, clicked_at, referrer, user_agent, visitor),
+    rollups: список (short_code, granularity, bucket, clicks),
+    sketches: {(short_code, day): HyperLogLog}. Всё в одной транзакции
+    """
+    if events:
+        await db.execute(insert(models.ClickEvent.__table__), [
+            {"short_code": short_code, "clicked_at": clicked_at, "referrer": referrer, "user_agent": user_agent}
+            for short_code, clicked_at, referrer, user_agent, _ in events
+        ])
+    if rollups:
+        await _upsert_click_rollups(db, [
+            {"short_code": short_code, "granularity": granularity, "bucket": bucket, "clicks": clicks}
+            for short_code, granularity, bucket, clicks in rollups
+        ])
+    if sketches:
+        await _merge_visitor_sketches(db, sketches)
+    await db.commit()
+
+@traced()
+async def count_unique_visitors(db: AsyncSession, short_code: str, since: datetime) -> int:
+    """
+    Оценка уникальных посетителей: объединение дневных скетчей начиная с дня since
+    """
+    table = models.VisitorSketch.__table__
+    stmt = (
+        select(table.c.registers)
+        .where(table.c.short_code == short_code, table.c.day >= since)
+        .execution_options(read_replica=True)
+    )
+    blobs = (await db.execute(stmt)).scalars().all()
+    if not blobs:
+        return 0
+    return HyperLogLog.merged(blobs).count()
+
+@traced()
+async def get_click_rollups(db: AsyncSession, short_code: str, granularity: str, since: datetime):
+    rollups = models.ClickRollup
+    stmt = (
+        select(rollups.bucket, rollups.clicks)
+        .where(rollups.short_code == short_code, rollups.granularity == granularity, rollups.bucket >= since)
+        .order_by(rollups.bucket)
+        .execution_options(read_replica=True)
+    )
+    return (await db.execute(stmt)).all()
+
+@traced()
+async def search_link_by_original_url(
+    db: AsyncSession,
+    original_url: str,
+    limit: int = None,
+    after_id: int = None
+):
+    """
+    Поиск по хэшу нормализованного URL через индекс (url_hash, id) с keyset-пагинацией
+    """
+    stmt = (
+        select(models.Link)
+        .where(models.Link.url_hash == url_hash(original_url))
+        .order_by(models.Link.id)
+        .execution_options(read_replica=True)
+    )
+    if after_id is not None:
+        stmt = stmt.where(models.Link.id > after_id)
+    if limit is not None:
+        stmt = stmt.limit(limit)
     result = await db.execute(stmt)
     return result.scalars().all()
+
+@traced()
+async def backfill_url_hashes(db: AsyncSession, batch_size: int = 1000) -> int:
+    """
+    Заполняет url_hash у ссылок, созданных до появления колонки
+    """
+    links = models.Link.__table__
+    total = 0
+    while True:
+        stmt = select(links.c.id, links.c.original_url).where(links.c.url_hash.is_(None)).limit(batch_size)
+        rows = (await db.execute(stmt)).all()
+        if not rows:
+            return total
+        await db.execute(
+            update(links).where(links.c.id == bindparam("b_id")).values(url_hash=bindparam("b_url_hash")),
+            [{"b_id": row.id, "b_url_hash": url_hash(row.original_url)} for row in rows]
+        )
+        await db.commit()
+        total += len(rows)
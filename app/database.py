@@ -1,21 +1,238 @@
+import logging
+import random
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlalchemy.sql.dml import UpdateBase
 from app.config import settings
+from app.utils.metrics import observe_query, statement_type
+from app.utils.tracing import request_trace
+
+logger = logging.getLogger(__name__)
 
 DATABASE_URL = settings.DATABASE_URL
 
-engine = create_async_engine(
-    DATABASE_URL,
-    echo=False,        
-    future=True
-)
+class InstrumentedAsyncAdaptedQueuePool(AsyncAdaptedQueuePool):
+    """
+    Пул, который считает время получения соединения (ожидание свободного
+    соединения плюс открытие нового, если пул разрешил overflow)
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.timeouts = 0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            trace = request_trace.get()
+            if trace is not None:
+                trace.add("db.pool_checkout", started, waited)
+            self.checkouts += 1
+            self.wait_time_total += waited
+            self.wait_time_max = max(self.wait_time_max, waited)
+            if waited * 1000 >= settings.DB_POOL_SLOW_WAIT_MS:
+                logger.warning(
+                    "Ожидание соединения из пула %.1f мс (занято %d, overflow %d)",
+                    waited * 1000, self.checkedout(), self.overflow()
+                )
+
+def engine_options(url: str) -> dict:
+    """
+    Параметры create_async_engine из Settings. Настройки пула и asyncpg
+    применяются только там, где они имеют смысл (не для SQLite)
+    """
+    options = {"echo": False, "future": True}
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite":
+        return options
+    options.update(
+        poolclass=InstrumentedAsyncAdaptedQueuePool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING
+    )
+    if url.get_driver_name() == "asyncpg":
+        connect_args = {"prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE}
+        if settings.DB_COMMAND_TIMEOUT:
+            connect_args["command_timeout"] = settings.DB_COMMAND_TIMEOUT
+        if settings.DB_STATEMENT_TIMEOUT_MS:
+            connect_args["server_settings"] = {"statement_timeout": str(settings.DB_STATEMENT_TIMEOUT_MS)}
+        options["connect_args"] = connect_args
+    return options
+
+def pool_status(async_engine) -> dict:
+    pool = async_engine.sync_engine.pool
+    status = {"class": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            checked_in=pool.checkedin(),
+            overflow=pool.overflow(),
+            max_overflow=pool._max_overflow
+        )
+    if isinstance(pool, InstrumentedAsyncAdaptedQueuePool):
+        status.update(
+            checkouts=pool.checkouts,
+            wait_time_avg_ms=round(pool.wait_time_total / pool.checkouts * 1000, 3) if pool.checkouts else 0.0,
+            wait_time_max_ms=round(pool.wait_time_max * 1000, 3),
+            timeouts=pool.timeouts
+        )
+    return status
+
+class RequestDBRouting:
+    """
+    Маршрутизация одного HTTP-запроса: force_primary — клиент недавно писал
+    и должен читать свои записи, wrote — запрос сам что-то записал
+    """
+    __slots__ = ("force_primary", "wrote")
+
+    def __init__(self, force_primary: bool = False):
+        self.force_primary = force_primary
+        self.wrote = False
+
+request_db_routing: ContextVar[Optional[RequestDBRouting]] = ContextVar("request_db_routing", default=None)
+
+class RoutingSession(Session):
+    """
+    Запросы с execution_options(read_replica=True) уходят на случайную реплику,
+    всё остальное — на primary. После первой записи сессия читает только с primary
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wrote = False
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        replicas = self.info.get("read_replicas")
+        routing = request_db_routing.get()
+        if (
+            replicas
+            and clause is not None
+            and clause.get_execution_options().get("read_replica")
+            and not self.wrote
+            and not (routing is not None and routing.force_primary)
+        ):
+            return random.choice(replicas)
+        # clause=None — flush или явный session.connection()
+        if clause is None or isinstance(clause, UpdateBase):
+            self.wrote = True
+            if routing is not None:
+                routing.wrote = True
+        return super().get_bind(mapper, clause=clause, **kw)
+
+def make_session_factory(primary, replicas=()):
+    return sessionmaker(
+        bind=primary,
+        autoflush=False,
+        autocommit=False,
+        expire_on_commit=False,
+        class_=AsyncSession,
+        sync_session_class=RoutingSession,
+        info={"read_replicas": [replica.sync_engine for replica in replicas]}
+    )
+
+engine = create_async_engine(DATABASE_URL, **engine_options(DATABASE_URL))
+
+replica_engines = [
+    create_async_engine(url, **engine_options(url))
+    for url in (url.strip() for url in settings.DATABASE_REPLICA_URLS.split(","))
+    if url
+]
 
-SessionLocal = sessionmaker(
-    bind=engine,
-    autoflush=False,
-    autocommit=False,
-    expire_on_commit=False,
-    class_=AsyncSession
-)
+SessionLocal = make_session_factory(engine, replica_engines)
 
 Base = declarative_base()
+
+class RequestDBStats:
+    """
+    Сколько сессий открыл и сколько SQL-запросов выполнил один HTTP-запрос
+    """
+    __slots__ = ("sessions", "queries", "query_time")
+
+    def __init__(self):
+        self.sessions = 0
+        self.queries = 0
+        self.query_time = 0.0
+
+request_db_stats: ContextVar[Optional[RequestDBStats]] = ContextVar("request_db_stats", default=None)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._query_started_at = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._query_started_at
+    observe_query(statement, elapsed)
+    trace = request_trace.get()
+    if trace is not None:
+        trace.add(f"sql.{statement_type(statement)}", context._query_started_at, elapsed)
+    stats = request_db_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.query_time += elapsed
+
+def instrument_engine(async_engine):
+    """
+    Подключает подсчёт запросов к движку (в тестах — к тестовому)
+    """
+    sync_engine = async_engine.sync_engine
+    if not event.contains(sync_engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+instrument_engine(engine)
+for replica_engine in replica_engines:
+    instrument_engine(replica_engine)
+
+class LazySession:
+    """
+    Обёртка над AsyncSession: сама сессия создаётся при первом обращении,
+    поэтому запросы, обслуженные из кэша или отклонённые раньше, её не открывают
+    """
+    def __init__(self, session_factory=None):
+        self._session_factory = session_factory or SessionLocal
+        self._session: Optional[AsyncSession] = None
+
+    @property
+    def session(self) -> AsyncSession:
+        if self._session is None:
+            self._session = self._session_factory()
+            stats = request_db_stats.get()
+            if stats is not None:
+                stats.sessions += 1
+        return self._session
+
+    @property
+    def opened(self) -> bool:
+        return self._session is not None
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+async def get_db():
+    db = LazySession()
+    try:
+        yield db
+    finally:
+        await db.close()
@@ -0,0 +1,50 @@
+import asyncio
+import hmac
+import threading
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+from fastapi.responses import PlainTextResponse
+
+from app.config import settings
+from app.utils.tracing import sampling_profiler, slow_traces
+
+router = APIRouter()
+
+def require_admin(x_admin_token: str = Header(None)):
+    """
+    Служебные эндпоинты доступны только с заголовком X-Admin-Token; без ADMIN_TOKEN они выключены
+    """
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token.encode(), settings.ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Нет доступа")
+
+@router.get("/profile", response_class=PlainTextResponse, dependencies=[Depends(require_admin)])
+async def profile(
+    seconds: float = Query(10.0, gt=0),
+    interval_ms: float = Query(10.0, ge=1, le=1000)
+):
+    """
+    Сэмплирующий профиль потока event loop за seconds секунд в формате collapsed stacks
+    (flamegraph.pl, speedscope). Профилирование одно на воркер
+    """
+    if seconds > settings.PROFILER_MAX_SECONDS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Профилирование не дольше {settings.PROFILER_MAX_SECONDS:g} с"
+        )
+    if sampling_profiler.running:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Профилирование уже идёт")
+    loop_thread = threading.get_ident()
+    try:
+        stacks = await asyncio.to_thread(sampling_profiler.profile, loop_thread, seconds, interval_ms / 1000)
+    except RuntimeError:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Профилирование уже идёт")
+    return PlainTextResponse(stacks)
+
+@router.get("/traces", dependencies=[Depends(require_admin)])
+async def traces():
+    """
+    Последние трассы медленных запросов (TRACE_SLOW_REQUEST_MS), новые в конце
+    """
+    return {"slow_request_ms": settings.TRACE_SLOW_REQUEST_MS, "traces": list(slow_traces)}
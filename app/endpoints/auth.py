@@ -1,12 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+import json
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import timedelta, datetime
 from jose import JWTError, jwt
-from app.database import SessionLocal
-from app.schemas import UserCreate, UserResponse, Token, TokenData
-from app.crud import create_user, get_user_by_username, get_password_hash
+from app.database import get_db
+from app.schemas import UserCreate, UserResponse, Token, TokenData, Principal, PasswordChange, UserLink
+from app.crud import (
+    create_user, get_user_by_username, get_user_by_id, get_password_hash,
+    change_user_password, delete_user, get_links_by_owner, stream_links_by_owner
+)
 from app.config import settings
+from app.utils.cache import get_cache, publish_user_revocation
+from app.utils.cache_backends import CacheBackend
+from app.utils.principals import principal_cache
 from pydantic import BaseModel
 
 router = APIRouter()
@@ -14,10 +24,6 @@ router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
 oauth2_scheme_optional = OAuth2PasswordBearer(tokenUrl="auth/token", auto_error=False)
 
-async def get_db():
-    async with SessionLocal() as db:
-        yield db
-
 def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
     if expires_delta:
@@ -33,6 +39,15 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     )
     return encoded_jwt
 
+def create_user_token(user) -> str:
+    """
+    В токене всё, что нужно для авторизации без похода в базу: id и версия токенов пользователя
+    """
+    return create_access_token(
+        data={"sub": user.username, "uid": user.id, "ver": user.token_version or 0},
+        expires_delta=timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+    )
+
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
     db: AsyncSession = Depends(get_db)
@@ -42,6 +57,10 @@ async def get_current_user(
         detail="Не удалось проверить токен",
         headers={"WWW-Authenticate": "Bearer"}
     )
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
+
     try:
         payload = jwt.decode(
             token,
@@ -55,10 +74,20 @@ async def get_current_user(
     except JWTError:
         raise credentials_exception
 
-    user = await get_user_by_username(db, token_data.username)
-    if user is None:
+    # токены, выданные до появления uid/ver, проверяем по имени пользователя
+    user_id = payload.get("uid")
+    if user_id is None:
+        user = await get_user_by_username(db, token_data.username)
+    else:
+        user = await get_user_by_id(db, user_id)
+    if user is None or user.username != token_data.username:
+        raise credentials_exception
+    if (user.token_version or 0) != payload.get("ver", 0):
         raise credentials_exception
-    return user
+
+    principal = Principal.from_orm(user)
+    principal_cache.set(token, principal, payload["exp"])
+    return principal
 
 async def get_current_user_optional(
     token: str = Depends(oauth2_scheme_optional),
@@ -79,7 +108,7 @@ async def register(
     """
     Создание нового пользователя, если такого username нет
     """
-    existing_user = await get_user_by_username(db, user.username)
+    existing_user = await get_user_by_username(db, user.username, use_replica=False)
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -112,16 +141,86 @@ async def login_for_access_token(
             headers={"WWW-Authenticate": "Bearer"}
         )
 
-    access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.username},
-        expires_delta=access_token_expires
-    )
-    return {"access_token": access_token, "token_type": "bearer"}
+    return {"access_token": create_user_token(user), "token_type": "bearer"}
 
 @router.get("/me", response_model=UserResponse)
-async def read_users_me(current_user: UserResponse = Depends(get_current_user)):
+async def read_users_me(current_user: Principal = Depends(get_current_user)):
     """
     Тестовый эндпоинт: возвращает информацию о текущем пользователе, если токен верный
     """
     return current_user
+
+@router.get("/me/links", response_model=List[UserLink])
+async def read_my_links(
+    response: Response,
+    limit: int = Query(settings.USER_LINKS_PAGE_SIZE, ge=1, le=settings.USER_LINKS_MAX_PAGE_SIZE),
+    cursor: Optional[int] = None,
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Ссылки текущего пользователя страницами по limit штук,
+    курсор следующей страницы возвращается в заголовке X-Next-Cursor
+    """
+    links = await get_links_by_owner(db, current_user.id, limit=limit + 1, after_id=cursor)
+    if len(links) > limit:
+        links = links[:limit]
+        response.headers["X-Next-Cursor"] = str(links[-1].id)
+    return links
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} не сериализуется в JSON")
+
+@router.get("/me/links/export")
+async def export_my_links(
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Все ссылки текущего пользователя в NDJSON (строка на ссылку), потоком пачками
+    """
+    async def rows():
+        async for chunk in stream_links_by_owner(db, current_user.id, settings.LINKS_EXPORT_CHUNK_SIZE):
+            yield "".join(json.dumps(dict(row), default=_json_default, ensure_ascii=False) + "\n" for row in chunk)
+
+    return StreamingResponse(
+        rows(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="links.ndjson"'}
+    )
+
+@router.put("/me/password", response_model=Token)
+async def change_password(
+    passwords: PasswordChange,
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+    cache: CacheBackend = Depends(get_cache)
+):
+    """
+    Смена пароля. Все ранее выданные токены перестают действовать, возвращаем новый
+    """
+    user = await get_user_by_id(db, current_user.id)
+    if user is None or get_password_hash(passwords.old_password) != user.hashed_password:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Неверный текущий пароль"
+        )
+    user = await change_user_password(db, user, passwords.new_password)
+    await publish_user_revocation(user.id, cache=cache)
+    return {"access_token": create_user_token(user), "token_type": "bearer"}
+
+@router.delete("/me", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_me(
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+    cache: CacheBackend = Depends(get_cache)
+):
+    """
+    Удаление аккаунта. Ссылки пользователя остаются, но без владельца
+    """
+    user = await get_user_by_id(db, current_user.id)
+    if user is not None:
+        await delete_user(db, user)
+    await publish_user_revocation(current_user.id, cache=cache)
@@ -1,53 +1,160 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
 from fastapi.responses import RedirectResponse
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List
+import time
 from datetime import datetime, timezone
+from typing import List, Optional
 from app import schemas, crud
-from app.database import SessionLocal
+from app.database import get_db
 from app.endpoints.auth import get_current_user, get_current_user_optional
 from app.schemas import UserResponse
+from app.config import settings
+from app.utils.bloom import short_code_filter
+from app.utils.clicks import GRANULARITIES, bucket_start, click_pipeline
+from app.utils.hll import visitor_fingerprint
+from app.utils.counters import redirect_counter
 
-from app.utils.cache import cache_link, get_cached_link, invalidate_cached_link
+from app.utils.cache import (
+    as_utc, cache_link, cache_links, cache_tombstone, get_cache, get_cached_link, is_expired, link_cache_record,
+    publish_invalidation, should_refresh_early
+)
+from app.utils.cache_backends import CacheBackend
+from app.utils.shortcode import short_code_encoder
+from app.utils.singleflight import SingleFlight
+from app.utils.routes import RESERVED_SHORT_CODES, static_segments
+from app.utils.trending import trending_links
 
 router = APIRouter()
 
-async def get_db():
-    async with SessionLocal() as db:
-        yield db
+link_loader = SingleFlight()
 
 @router.post("/shorten", response_model=schemas.LinkResponse)
 async def create_short_link(
     link: schemas.LinkCreate,
     db: AsyncSession = Depends(get_db),
+    cache: CacheBackend = Depends(get_cache),
     current_user: UserResponse = Depends(get_current_user_optional)
 ):
     """
     Создаем короткую ссылку. Если пользователь авторизован — привязываем к его owner_id
     """
     owner_id = current_user.id if current_user else None
-    db_link = await crud.create_link(db, link, owner_id=owner_id)
+    if link.custom_alias:
+        if short_code_encoder.is_generated(link.custom_alias):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Алиас совпадает с форматом автоматически сгенерированных кодов"
+            )
+        if await crud.get_link_by_short_code(db, link.custom_alias):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Алиас уже занят"
+            )
+    try:
+        db_link = await crud.create_link(db, link, owner_id=owner_id)
+    except IntegrityError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Алиас уже занят"
+        )
 
-    await cache_link(db_link.short_code, {"original_url": db_link.original_url})
+    await cache_link(db_link.short_code, link_cache_record(db_link), cache=cache)
+    # у других воркеров мог остаться отрицательный кэш для этого кода, а их Bloom-фильтр о нём ещё не знает
+    await publish_invalidation(db_link.short_code, cache=cache)
     return db_link
 
+@router.post("/shorten/batch", response_model=schemas.LinkBatchResponse)
+async def create_short_links_batch(
+    batch: schemas.LinkBatchCreate,
+    db: AsyncSession = Depends(get_db),
+    cache: CacheBackend = Depends(get_cache),
+    current_user: UserResponse = Depends(get_current_user_optional)
+):
+    """
+    Создаём пачку коротких ссылок за один INSERT. Конфликт алиаса не валит всю пачку,
+    а возвращается в результате для конкретного элемента
+    """
+    owner_id = current_user.id if current_user else None
+    created = await crud.create_links_batch(db, batch.items, owner_id=owner_id)
+
+    results = []
+    records = {}
+    for index, (db_link, detail) in enumerate(created):
+        if db_link is None:
+            results.append(schemas.LinkBatchItemResult(index=index, status="conflict", detail=detail))
+            continue
+        records[db_link.short_code] = link_cache_record(db_link)
+        results.append(schemas.LinkBatchItemResult(
+            index=index,
+            status="created",
+            link=schemas.LinkResponse.from_orm(db_link)
+        ))
+    await cache_links(records, cache=cache)
+    return schemas.LinkBatchResponse(
+        created=len(records),
+        failed=len(results) - len(records),
+        results=results
+    )
+
 @router.get("/search", response_model=List[schemas.LinkResponse])
-async def search_links(original_url: str, db: AsyncSession = Depends(get_db)):
+async def search_links(
+    original_url: str,
+    response: Response,
+    limit: int = Query(settings.SEARCH_PAGE_SIZE, ge=1, le=settings.SEARCH_MAX_PAGE_SIZE),
+    cursor: Optional[int] = None,
+    db: AsyncSession = Depends(get_db)
+):
     """
-    Ищем все короткие ссылки по оригинальному URL
+    Ищем короткие ссылки по оригинальному URL. Страницы по limit штук,
+    курсор следующей страницы возвращается в заголовке X-Next-Cursor
     """
-    links = await crud.search_link_by_original_url(db, original_url)
-    if not links:
+    links = await crud.search_link_by_original_url(db, original_url, limit=limit + 1, after_id=cursor)
+    if not links and cursor is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Ссылки не найдены"
         )
+    if len(links) > limit:
+        links = links[:limit]
+        response.headers["X-Next-Cursor"] = str(links[-1].id)
     return links
 
+@router.get("/trending", response_model=schemas.TrendingResponse)
+async def get_trending_links(
+    window: str = "1h",
+    limit: int = Query(10, ge=1, le=settings.TRENDING_MAX_LIMIT)
+):
+    """
+    Самые популярные ссылки за окно по данным этого воркера, без запросов к базе.
+    score — число переходов с затуханием, error — верхняя граница его переоценки
+    """
+    try:
+        top = trending_links.top(window, limit)
+    except KeyError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Неизвестное окно. Доступны: {', '.join(trending_links.windows)}"
+        )
+    return schemas.TrendingResponse(
+        window=window,
+        links=[
+            schemas.TrendingLink(short_code=short_code, score=round(score, 3), error=round(error, 3))
+            for short_code, score, error in top
+        ]
+    )
+
 @router.get("/{short_code}/stats", response_model=schemas.LinkStats)
-async def get_link_stats(short_code: str, db: AsyncSession = Depends(get_db)):
+async def get_link_stats(
+    short_code: str,
+    granularity: str = Query("hour", regex="^(hour|day)$"),
+    buckets: int = Query(24, ge=1, le=settings.CLICK_STATS_MAX_BUCKETS),
+    db: AsyncSession = Depends(get_db)
+):
     """
-    Возвращаем статистику по короткой ссылке
+    Возвращаем статистику по короткой ссылке и ряд переходов за последние
+    buckets часов или дней (из свёрток, без чтения сырых событий).
+    unique_visitors — оценка HyperLogLog за дни, которые покрывает ряд
     """
     db_link = await crud.get_link_by_short_code(db, short_code)
     if not db_link:
@@ -55,47 +162,89 @@ async def get_link_stats(short_code: str, db: AsyncSession = Depends(get_db)):
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Ссылка не найдена"
         )
-    return db_link
+    pending, pending_accessed_at = redirect_counter.pending(short_code)
+    accessed = [as_utc(db_link.last_accessed_at), pending_accessed_at]
+
+    step = GRANULARITIES[granularity]
+    since = bucket_start(datetime.now(timezone.utc), granularity) - step * (buckets - 1)
+    rollups = await crud.get_click_rollups(db, short_code, granularity, since)
+    clicks = {as_utc(bucket): count for bucket, count in rollups}
+    unique_visitors = await crud.count_unique_visitors(db, short_code, bucket_start(since, "day"))
+    series = [
+        schemas.ClickBucket(bucket=since + step * i, clicks=clicks.get(since + step * i, 0))
+        for i in range(buckets)
+    ]
+    return schemas.LinkStats(
+        original_url=db_link.original_url,
+        created_at=db_link.created_at,
+        redirect_count=(db_link.redirect_count or 0) + pending,
+        last_accessed_at=max(filter(None, accessed), default=None),
+        unique_visitors=unique_visitors,
+        granularity=granularity,
+        series=series
+    )
+
+async def _load_link_record(db: AsyncSession, short_code: str, cache: CacheBackend):
+    started = time.perf_counter()
+    db_link = await crud.get_link_by_short_code(db, short_code)
+    if not db_link:
+        if settings.NEGATIVE_CACHE_TTL > 0:
+            await cache_tombstone(short_code, cache=cache, expire=settings.NEGATIVE_CACHE_TTL)
+        return None
+    record = link_cache_record(db_link)
+    record["load_time"] = round(time.perf_counter() - started, 6)
+    await cache_link(short_code, record, cache=cache)
+    return record
+
+def record_redirect(short_code: str, referrer: Optional[str], user_agent: Optional[str], client_host: Optional[str]):
+    """
+    Учёт перехода: счётчик, top-K и событие клика. Общий для роутера и быстрого пути
+    """
+    redirect_counter.record(short_code)
+    trending_links.record(short_code)
+    click_pipeline.record(short_code, referrer, user_agent, visitor=visitor_fingerprint(client_host, user_agent))
 
 @router.get("/{short_code}")
 async def redirect_to_original(
     short_code: str,
-    db: AsyncSession = Depends(get_db)
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    cache: CacheBackend = Depends(get_cache)
 ):
     """
     Отправляем на оригинальный URL по короткому коду
     """
-    cached = await get_cached_link(short_code)
-    if cached:
-        db_link = await crud.get_link_by_short_code(db, short_code)
-        if not db_link:
-            raise HTTPException(status_code=404, detail="Ссылка не найдена")
-        if db_link.expires_at and db_link.expires_at < datetime.now(timezone.utc):
-            raise HTTPException(status_code=410, detail="Срок действия ссылки истёк")
+    if not short_code_filter.might_exist(short_code):
+        raise HTTPException(status_code=404, detail="Ссылка не найдена")
 
-        await crud.increment_redirect_count(db, db_link)
-        return RedirectResponse(url=cached["original_url"])
+    cached = await get_cached_link(short_code, cache=cache)
+    if not cached or should_refresh_early(cached):
+        cached = await link_loader.do(short_code, lambda: _load_link_record(db, short_code, cache))
 
-    db_link = await crud.get_link_by_short_code(db, short_code)
-    if not db_link:
+    if not cached or cached.get("deleted"):
         raise HTTPException(status_code=404, detail="Ссылка не найдена")
-    if db_link.expires_at and db_link.expires_at < datetime.now(timezone.utc):
+    if is_expired(cached.get("expires_at")):
         raise HTTPException(status_code=410, detail="Срок действия ссылки истёк")
 
-    await crud.increment_redirect_count(db, db_link)
-    await cache_link(short_code, {"original_url": db_link.original_url})
-    return RedirectResponse(url=db_link.original_url)
+    record_redirect(
+        short_code,
+        request.headers.get("referer"),
+        request.headers.get("user-agent"),
+        request.client.host if request.client else None
+    )
+    return RedirectResponse(url=cached["original_url"])
 
 @router.delete("/{short_code}", response_model=schemas.LinkResponse)
 async def delete_short_link(
     short_code: str,
     db: AsyncSession = Depends(get_db),
+    cache: CacheBackend = Depends(get_cache),
     current_user: UserResponse = Depends(get_current_user)
 ):
     """
     Удаляем короткую ссылку, доступно только создателю ссылки
     """
-    db_link = await crud.get_link_by_short_code(db, short_code)
+    db_link = await crud.get_link_by_short_code(db, short_code, use_replica=False)
     if not db_link:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -108,7 +257,9 @@ async def delete_short_link(
         )
 
     deleted_link = await crud.delete_link(db, short_code)
-    await invalidate_cached_link(short_code)
+    trending_links.discard(short_code)
+    await cache_tombstone(short_code, cache=cache)
+    await publish_invalidation(short_code, cache=cache)
     return deleted_link
 
 @router.put("/{short_code}", response_model=schemas.LinkResponse)
@@ -116,12 +267,13 @@ async def update_short_link(
     short_code: str,
     link_update: schemas.LinkUpdate,
     db: AsyncSession = Depends(get_db),
+    cache: CacheBackend = Depends(get_cache),
     current_user: UserResponse = Depends(get_current_user)
 ):
     """
     Обновляем оригинальный URL и/или expires_at, доступно только создателю ссылки
     """
-    db_link = await crud.get_link_by_short_code(db, short_code)
+    db_link = await crud.get_link_by_short_code(db, short_code, use_replica=False)
     if not db_link:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -134,6 +286,11 @@ async def update_short_link(
         )
 
     updated_link = await crud.update_link(db, short_code, link_update)
-    await invalidate_cached_link(short_code)
-    await cache_link(short_code, {"original_url": updated_link.original_url})
+    await cache_link(short_code, link_cache_record(updated_link), cache=cache)
+    await publish_invalidation(short_code, cache=cache)
     return updated_link
+
+if not static_segments(router.routes) <= RESERVED_SHORT_CODES:
+    raise RuntimeError(
+        f"Добавьте {sorted(static_segments(router.routes) - RESERVED_SHORT_CODES)} в RESERVED_SHORT_CODES"
+    )
@@ -0,0 +1,78 @@
+"""
+Массовая загрузка ссылок из файла: python -m app.importer links.jsonl --owner alice
+Формат JSONL или CSV с полями original_url, custom_alias, expires_at.
+Прерванная загрузка продолжается повторным запуском той же команды
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+def _print_progress(report):
+    print(
+        f"\rзаписей {report.resumed_from + report.records}, загружено {report.imported}, "
+        f"отклонено {report.rejected}, {report.rows_per_second} строк/с",
+        end="", file=sys.stderr, flush=True
+    )
+
+async def _run(args) -> dict:
+    from app import crud
+    from app.database import SessionLocal, engine
+    from app.importer.bulk import BulkImporter
+    from app.initial_db import init_db
+    from app.utils.cache import close_cache
+
+    await init_db()
+    try:
+        owner_id = None
+        if args.owner:
+            async with SessionLocal() as db:
+                owner = await crud.get_user_by_username(db, args.owner, use_replica=False)
+            if owner is None:
+                raise SystemExit(f"Пользователь {args.owner!r} не найден")
+            owner_id = owner.id
+        importer = BulkImporter(
+            SessionLocal,
+            chunk_size=args.chunk_size,
+            owner_id=owner_id,
+            cache_fill=args.cache_fill,
+            progress=_print_progress
+        )
+        report = await importer.run(args.path, fmt=args.format, job_id=args.job, restart=args.restart)
+        print(file=sys.stderr)
+    finally:
+        await close_cache()
+        await engine.dispose()
+
+    if args.rejects:
+        with open(args.rejects, "a") as f:
+            for rejection in report.rejections:
+                f.write(json.dumps(rejection, ensure_ascii=False) + "\n")
+    for rejection in report.rejections[:10]:
+        print(f"строка {rejection['line']}: {rejection['error']}", file=sys.stderr)
+    return report.to_dict()
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.importer")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=("jsonl", "csv"), help="по умолчанию по расширению файла")
+    parser.add_argument("--owner", help="username владельца загружаемых ссылок")
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--job", help="id загрузки для продолжения; по умолчанию из пути, размера и mtime файла")
+    parser.add_argument("--restart", action="store_true", help="начать заново, не глядя на чекпоинт")
+    parser.add_argument("--cache-fill", action=argparse.BooleanOptionalAction, default=True,
+                        help="заполнять кэш загруженными ссылками")
+    parser.add_argument("--rejects", help="дописать отклонённые записи в этот файл (JSONL)")
+    parser.add_argument("--database-url", help="по умолчанию DATABASE_URL")
+    args = parser.parse_args(argv)
+
+    if args.database_url:
+        # настройки читаются при импорте app.config
+        os.environ["DATABASE_URL"] = args.database_url
+    report = asyncio.run(_run(args))
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
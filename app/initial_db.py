@@ -1,5 +1,69 @@
-from app.database import engine, Base
+"""
+Миграция схемы: python -m app.initial_db. Запускается один раз перед стартом воркеров,
+сами воркеры только проверяют, что она выполнена
+"""
+import asyncio
+import logging
+
+from sqlalchemy import Column, inspect, select, text
+
+from app.database import engine, Base, SessionLocal
+from app import crud, models
+
+logger = logging.getLogger(__name__)
+
+def missing_schema(sync_conn) -> list:
+    """
+    create_all не трогает существующие таблицы: колонки и индексы модели, появившиеся позже
+    """
+    inspector = inspect(sync_conn)
+    missing = []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        missing.extend(column for column in table.columns if column.name not in columns)
+        missing.extend(index for index in table.indexes if index.name not in indexes)
+    return missing
+
+def upgrade_schema(sync_conn):
+    """
+    Досоздаёт недостающее. Новые колонки должны быть nullable или иметь server_default
+    """
+    for item in missing_schema(sync_conn):
+        if isinstance(item, Column):
+            ddl = f"ALTER TABLE {item.table.name} ADD COLUMN {item.name} {item.type.compile(dialect=sync_conn.dialect)}"
+            if item.server_default is not None:
+                ddl += f" DEFAULT {item.server_default.arg}"
+            sync_conn.execute(text(ddl))
+        else:
+            item.create(sync_conn, checkfirst=True)
+
+async def migrate():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(upgrade_schema)
+    async with SessionLocal() as db:
+        return await crud.backfill_url_hashes(db)
 
 async def init_db():
+    """
+    Пустую базу создаёт целиком, устаревшую схему не трогает: без миграции воркер не стартует
+    """
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        missing = await conn.run_sync(missing_schema)
+    if missing:
+        names = ", ".join(f"{item.table.name}.{item.name}" for item in missing)
+        raise RuntimeError(f"Схема базы устарела ({names}), выполните python -m app.initial_db")
+    async with SessionLocal() as db:
+        links = models.Link
+        stmt = select(links.id).where(links.url_hash.is_(None)).limit(1)
+        if (await db.execute(stmt)).first() is not None:
+            logger.warning("Есть ссылки без url_hash, поиск их не найдёт: выполните python -m app.initial_db")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    filled = asyncio.run(migrate())
+    logger.info("Схема обновлена, url_hash заполнен у %s ссылок", filled)
@@ -1,24 +1,99 @@
-from fastapi import FastAPI
-from app.endpoints import links, auth
+from fastapi import FastAPI, Response, status
+from fastapi.responses import PlainTextResponse
+from app.endpoints import links, auth, admin
+from app.database import engine, pool_status, replica_engines
 from app.initial_db import init_db
+from app.middleware import (
+    DBStatsMiddleware, MetricsMiddleware, ReadYourWritesMiddleware, RedirectFastPathMiddleware, TracingMiddleware
+)
+from app.utils.cache import init_cache, close_cache, local_cache
+from app.utils.bloom import short_code_filter
+from app.utils.clicks import click_pipeline
+from app.utils.counters import redirect_counter
+from app.utils.metrics import metrics_exporter
+from app.utils.principals import principal_cache
+from app.utils.sweeper import expired_link_sweeper
+from app.utils.trending import trending_links
+from app.utils.warmup import cache_warmer
 
 app = FastAPI(
     title="Shorturler API",
     description="Сокращатель ссылок",
     version="1.0"
 )
+app.add_middleware(DBStatsMiddleware)
+app.add_middleware(ReadYourWritesMiddleware)
+# внешний слой: попадания в кэш не доходят до остальных middleware и роутера
+app.add_middleware(RedirectFastPathMiddleware)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(TracingMiddleware)
 
 @app.on_event("startup")
 async def on_startup():
     await init_db()
+    await init_cache()
+    cache_warmer.start()
+    short_code_filter.start_build()
+    redirect_counter.start()
+    click_pipeline.start()
+    expired_link_sweeper.start()
+    if metrics_exporter.enabled:
+        metrics_exporter.start()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await expired_link_sweeper.stop()
+    if metrics_exporter.enabled:
+        await metrics_exporter.stop()
+    await redirect_counter.stop()
+    await click_pipeline.stop()
+    await cache_warmer.close()
+    await short_code_filter.close()
+    await close_cache()
 
 app.include_router(links.router, prefix="/links", tags=["Links"])
 app.include_router(auth.router, prefix="/auth", tags=["Authentication"])
+app.include_router(admin.router, prefix="/admin", tags=["Admin"])
 
 @app.get("/")
 async def root():
     return {"message": "Добро пожаловать в Shorturler!"}
 
+@app.get("/ready", tags=["Internal"])
+async def readiness(response: Response):
+    """
+    Готовность воркера принимать трафик: 503, пока не закончился прогрев кэша
+    """
+    if not cache_warmer.ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        return {"status": "warming_up"}
+    return {"status": "ready", "cache_warmup": cache_warmer.stats()}
+
+@app.get("/metrics", tags=["Internal"], response_class=PlainTextResponse)
+async def metrics():
+    """
+    Метрики в текстовом формате Prometheus (при METRICS_MULTIPROC_DIR — по всем воркерам)
+    """
+    return PlainTextResponse(metrics_exporter.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/internal/stats", tags=["Internal"])
+async def internal_stats():
+    """
+    Счётчики внутренних кэшей воркера для подбора их размеров
+    """
+    return {
+        "local_cache": local_cache.stats(),
+        "single_flight": links.link_loader.stats(),
+        "bloom_filter": short_code_filter.stats(),
+        "principal_cache": principal_cache.stats(),
+        "click_pipeline": click_pipeline.stats(),
+        "trending": trending_links.stats(),
+        "expired_link_sweeper": expired_link_sweeper.stats(),
+        "cache_warmup": cache_warmer.stats(),
+        "db_pool": pool_status(engine),
+        "db_replica_pools": [pool_status(replica) for replica in replica_engines]
+    }
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
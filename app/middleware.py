@@ -0,0 +1,227 @@
+import logging
+import time
+from http.cookies import CookieError, SimpleCookie
+from urllib.parse import quote
+
+from app.config import settings
+from app.database import RequestDBRouting, RequestDBStats, request_db_routing, request_db_stats
+from app.endpoints.links import record_redirect
+from app.utils.metrics import http_in_flight, observe_request
+from app.utils.tracing import RequestTrace, report_slow_request, request_trace
+from app.utils.bloom import short_code_filter
+from app.utils.cache import get_cache, get_cached_link, is_expired, should_refresh_early
+from app.utils.routes import RESERVED_SHORT_CODES
+
+logger = logging.getLogger(__name__)
+
+class DBStatsMiddleware:
+    """
+    Считает сессии и SQL-запросы каждого HTTP-запроса. При DB_STATS_HEADERS
+    отдаёт их в заголовках X-DB-Sessions / X-DB-Queries
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestDBStats()
+        token = request_db_stats.set(stats)
+
+        async def send_with_stats(message):
+            if message["type"] == "http.response.start" and settings.DB_STATS_HEADERS:
+                headers = list(message.get("headers", []))
+                headers.append((b"x-db-sessions", str(stats.sessions).encode()))
+                headers.append((b"x-db-queries", str(stats.queries).encode()))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_stats)
+        finally:
+            request_db_stats.reset(token)
+            logger.debug(
+                "%s %s: сессий %d, запросов %d, %.1f мс в базе",
+                scope["method"], scope["path"], stats.sessions, stats.queries, stats.query_time * 1000
+            )
+
+PRIMARY_COOKIE = "db_primary_until"
+
+class ReadYourWritesMiddleware:
+    """
+    После запроса с записью ставит клиенту cookie, и следующие
+    DB_READ_YOUR_WRITES_SECONDS его запросы читают с primary, а не с реплик
+    """
+    def __init__(self, app):
+        self.app = app
+
+    @staticmethod
+    def _primary_until(scope) -> float:
+        for name, value in scope.get("headers", []):
+            if name != b"cookie":
+                continue
+            try:
+                cookie = SimpleCookie(value.decode("latin-1"))
+            except CookieError:
+                return 0.0
+            if PRIMARY_COOKIE in cookie:
+                try:
+                    return float(cookie[PRIMARY_COOKIE].value)
+                except ValueError:
+                    return 0.0
+        return 0.0
+
+    async def __call__(self, scope, receive, send):
+        window = settings.DB_READ_YOUR_WRITES_SECONDS
+        if scope["type"] != "http" or window <= 0 or not settings.DATABASE_REPLICA_URLS:
+            await self.app(scope, receive, send)
+            return
+
+        routing = RequestDBRouting(force_primary=self._primary_until(scope) > time.time())
+        token = request_db_routing.set(routing)
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start" and routing.wrote:
+                cookie = (
+                    f"{PRIMARY_COOKIE}={time.time() + window:.3f}; "
+                    f"Max-Age={int(window) + 1}; Path=/; HttpOnly; SameSite=Lax"
+                )
+                headers = list(message.get("headers", []))
+                headers.append((b"set-cookie", cookie.encode()))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_cookie)
+        finally:
+            request_db_routing.reset(token)
+
+class RedirectFastPathMiddleware:
+    """
+    GET {prefix}{short_code}, найденный в кэше, обслуживается без роутинга FastAPI
+    и зависимостей: сразу 307 с Location. Промах, удалённая или истёкшая ссылка,
+    ранний рефреш и любые ошибки уходят в обычный обработчик
+    """
+    def __init__(self, app, prefix: str = "/links/", reserved=None):
+        self.app = app
+        self.prefix = prefix
+        self.reserved = RESERVED_SHORT_CODES if reserved is None else frozenset(reserved)
+
+    def _short_code(self, scope):
+        if scope["type"] != "http" or scope["method"] != "GET" or not settings.REDIRECT_FAST_PATH:
+            return None
+        path = scope["path"]
+        if not path.startswith(self.prefix):
+            return None
+        short_code = path[len(self.prefix):]
+        if not short_code or "/" in short_code or short_code in self.reserved:
+            return None
+        return short_code
+
+    async def _lookup(self, short_code: str):
+        if not short_code_filter.might_exist(short_code):
+            return None
+        cached = await get_cached_link(short_code, cache=get_cache())
+        if (
+            not cached
+            or cached.get("deleted")
+            or is_expired(cached.get("expires_at"))
+            or should_refresh_early(cached)
+        ):
+            return None
+        return cached["original_url"]
+
+    async def __call__(self, scope, receive, send):
+        short_code = self._short_code(scope)
+        if short_code is None:
+            await self.app(scope, receive, send)
+            return
+        try:
+            original_url = await self._lookup(short_code)
+        except Exception:
+            logger.warning("Быстрый путь редиректа не сработал для %s", short_code, exc_info=True)
+            original_url = None
+        if original_url is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        client = scope.get("client")
+        record_redirect(
+            short_code,
+            headers.get(b"referer", b"").decode("latin-1") or None,
+            headers.get(b"user-agent", b"").decode("latin-1") or None,
+            client[0] if client else None
+        )
+        scope["metrics_route"] = self.prefix + "{short_code}"
+        await send({
+            "type": "http.response.start",
+            "status": 307,
+            "headers": [
+                (b"location", quote(original_url, safe=":/%#?=@[]!$&'()*+,;").encode("latin-1")),
+                (b"content-length", b"0"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": b""})
+
+class MetricsMiddleware:
+    """
+    Время обработки и коды ответов по шаблону маршрута (а не по пути,
+    чтобы short_code не раздували число рядов) и число запросов в обработке
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        http_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_in_flight.dec()
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or scope.get("metrics_route") or "unmatched"
+            observe_request(scope["method"], route_path, status_code, time.perf_counter() - started)
+
+class TracingMiddleware:
+    """
+    При TRACE_SLOW_REQUEST_MS > 0 собирает отрезки времени запроса (crud, кэш, SQL, ожидание пула)
+    и логирует трассу запросов медленнее порога
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or settings.TRACE_SLOW_REQUEST_MS <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        trace = RequestTrace()
+        token = request_trace.set(trace)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            request_trace.reset(token)
+            report_slow_request(scope["method"], scope["path"], status_code, trace)
@@ -1,4 +1,6 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text
+from sqlalchemy import (
+    BigInteger, Column, Integer, String, DateTime, ForeignKey, Index, LargeBinary, PrimaryKeyConstraint, Text, text
+)
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.database import Base
@@ -8,6 +10,7 @@ class User(Base):
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String(50), unique=True, index=True, nullable=False)
     hashed_password = Column(String(255), nullable=False)
+    token_version = Column(Integer, nullable=False, default=0, server_default="0")
     created_at = Column(DateTime(timezone=True), default=datetime.utcnow)
     links = relationship("Link", back_populates="owner")
 
@@ -16,6 +19,7 @@ class Link(Base):
     __tablename__ = "links"
     id = Column(Integer, primary_key=True, index=True)
     original_url = Column(Text, nullable=False)
+    url_hash = Column(String(64), nullable=True)
     short_code = Column(String(50), unique=True, index=True, nullable=False)
     created_at = Column(DateTime(timezone=True), default=datetime.utcnow)
     redirect_count = Column(Integer, default=0)
@@ -23,3 +27,78 @@ class Link(Base):
     expires_at = Column(DateTime(timezone=True), nullable=True)
     owner_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     owner = relationship("User", back_populates="links")
+
+    __table_args__ = (
+        Index("ix_links_url_hash_id", "url_hash", "id"),
+        Index("ix_links_owner_id_id", "owner_id", "id"),
+        # частичный: бессрочные ссылки (большинство) в индекс не попадают
+        Index(
+            "ix_links_expires_at",
+            "expires_at",
+            postgresql_where=text("expires_at IS NOT NULL"),
+            sqlite_where=text("expires_at IS NOT NULL")
+        ),
+        # для прогрева кэша; ссылки, по которым ни разу не переходили, в индекс не попадают
+        Index(
+            "ix_links_last_accessed_at_id",
+            "last_accessed_at",
+            "id",
+            postgresql_where=text("last_accessed_at IS NOT NULL"),
+            sqlite_where=text("last_accessed_at IS NOT NULL")
+        ),
+    )
+
+
+class ShortCodeCounter(Base):
+    __tablename__ = "short_code_counters"
+    name = Column(String(50), primary_key=True)
+    next_value = Column(BigInteger, nullable=False)
+
+
+class ClickEvent(Base):
+    __tablename__ = "click_events"
+    # SQLite автоинкрементирует только INTEGER PRIMARY KEY
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    short_code = Column(String(50), nullable=False)
+    clicked_at = Column(DateTime(timezone=True), nullable=False)
+    referrer = Column(Text, nullable=True)
+    user_agent = Column(Text, nullable=True)
+
+    __table_args__ = (
+        Index("ix_click_events_short_code_clicked_at", "short_code", "clicked_at"),
+    )
+
+
+class ClickRollup(Base):
+    __tablename__ = "click_rollups"
+    short_code = Column(String(50), nullable=False)
+    granularity = Column(String(8), nullable=False)
+    bucket = Column(DateTime(timezone=True), nullable=False)
+    clicks = Column(BigInteger, nullable=False, default=0)
+
+    __table_args__ = (
+        PrimaryKeyConstraint("short_code", "granularity", "bucket"),
+    )
+
+
+class VisitorSketch(Base):
+    __tablename__ = "visitor_sketches"
+    short_code = Column(String(50), nullable=False)
+    day = Column(DateTime(timezone=True), nullable=False)
+    registers = Column(LargeBinary, nullable=False)
+
+    __table_args__ = (
+        PrimaryKeyConstraint("short_code", "day"),
+    )
+
+
+class ImportCheckpoint(Base):
+    __tablename__ = "import_checkpoints"
+    job_id = Column(String(64), primary_key=True)
+    source = Column(Text, nullable=False)
+    # сколько записей файла уже обработано (вставлено или отклонено)
+    records_done = Column(BigInteger, nullable=False, default=0)
+    rows_imported = Column(BigInteger, nullable=False, default=0)
+    rows_rejected = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), nullable=False)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
@@ -1,7 +1,10 @@
-from pydantic import BaseModel, HttpUrl
+from pydantic import BaseModel, HttpUrl, conlist, validator
 from datetime import datetime
 from typing import Optional, List
 
+from app.config import settings
+from app.utils.routes import RESERVED_SHORT_CODES
+
 class LinkBase(BaseModel):
     original_url: HttpUrl
     expires_at: Optional[datetime] = None
@@ -9,6 +12,12 @@ class LinkBase(BaseModel):
 class LinkCreate(LinkBase):
     custom_alias: Optional[str] = None
 
+    @validator("custom_alias")
+    def alias_is_not_a_route(cls, value):
+        if value is not None and value in RESERVED_SHORT_CODES:
+            raise ValueError("Алиас совпадает с путём API")
+        return value
+
 class LinkUpdate(BaseModel):
     original_url: Optional[HttpUrl] = None
     expires_at: Optional[datetime] = None
@@ -22,15 +31,49 @@ class LinkResponse(BaseModel):
     class Config:
         orm_mode = True
 
+class UserLink(LinkResponse):
+    redirect_count: int = 0
+    last_accessed_at: Optional[datetime] = None
+
+class LinkBatchCreate(BaseModel):
+    items: conlist(LinkCreate, min_items=1, max_items=settings.BATCH_SHORTEN_MAX_ITEMS)
+
+class LinkBatchItemResult(BaseModel):
+    index: int
+    status: str
+    link: Optional[LinkResponse] = None
+    detail: Optional[str] = None
+
+class LinkBatchResponse(BaseModel):
+    created: int
+    failed: int
+    results: List[LinkBatchItemResult]
+
+class ClickBucket(BaseModel):
+    bucket: datetime
+    clicks: int
+
 class LinkStats(BaseModel):
     original_url: HttpUrl
     created_at: datetime
     redirect_count: int
     last_accessed_at: Optional[datetime] = None
+    unique_visitors: Optional[int] = None
+    granularity: Optional[str] = None
+    series: List[ClickBucket] = []
 
     class Config:
         orm_mode = True
 
+class TrendingLink(BaseModel):
+    short_code: str
+    score: float
+    error: float
+
+class TrendingResponse(BaseModel):
+    window: str
+    links: List[TrendingLink]
+
 class LinkSearch(BaseModel):
     original_url: HttpUrl
 
@@ -50,6 +93,19 @@ class UserResponse(UserBase):
     class Config:
         orm_mode = True
 
+class PasswordChange(BaseModel):
+    old_password: str
+    new_password: str
+
+class Principal(BaseModel):
+    id: int
+    username: str
+    created_at: datetime
+    token_version: int = 0
+
+    class Config:
+        orm_mode = True
+
 class Token(BaseModel):
     access_token: str
     token_type: str
@@ -1,15 +1,19 @@
 import asyncio
+import os
 import pytest_asyncio
-import aioredis
 from httpx import AsyncClient
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 
-from app.database import Base
+# тесты не требуют Redis: кэш живёт в памяти процесса
+os.environ["CACHE_BACKEND"] = "memory"
+
+from app.database import Base, LazySession, get_db, instrument_engine
 from app.main import app
-from app.endpoints.auth import get_db as auth_get_db
-from app.endpoints.links import get_db as links_get_db
-from app.config import settings
+from app.utils.cache import get_cache, local_cache
+from app.utils.clicks import click_pipeline
+from app.utils.counters import redirect_counter
+from app.utils.sweeper import expired_link_sweeper
 
 @pytest_asyncio.fixture(scope="session")
 def event_loop():
@@ -30,12 +34,19 @@ TestingSessionLocal = sessionmaker(
     expire_on_commit=False
 )
 
+instrument_engine(engine_test)
+
 async def override_get_db():
-    async with TestingSessionLocal() as session:
+    session = LazySession(TestingSessionLocal)
+    try:
         yield session
+    finally:
+        await session.close()
 
-app.dependency_overrides[auth_get_db] = override_get_db
-app.dependency_overrides[links_get_db] = override_get_db
+app.dependency_overrides[get_db] = override_get_db
+redirect_counter.session_factory = TestingSessionLocal
+click_pipeline.session_factory = TestingSessionLocal
+expired_link_sweeper.session_factory = TestingSessionLocal
 
 @pytest_asyncio.fixture(scope="session")
 async def prepare_database():
@@ -45,15 +56,23 @@ async def prepare_database():
     async with engine_test.begin() as conn:
         await conn.run_sync(Base.metadata.drop_all)
 
+@pytest_asyncio.fixture(scope="session")
+async def session_factory(prepare_database):
+    return TestingSessionLocal
+
 @pytest_asyncio.fixture(scope="session")
 async def async_client(prepare_database):
     async with AsyncClient(app=app, base_url="http://test") as client:
         yield client
 
+@pytest_asyncio.fixture
+async def cache():
+    return get_cache()
+
 @pytest_asyncio.fixture(autouse=True, scope="function")
-async def clear_redis():
-    async with aioredis.from_url(settings.REDIS_URL, decode_responses=True) as redis:
-        await redis.flushdb()
+async def clear_cache():
+    await get_cache().flush()
+    local_cache.clear()
     yield
-    async with aioredis.from_url(settings.REDIS_URL, decode_responses=True) as redis:
-        await redis.flushdb()
+    await get_cache().flush()
+    local_cache.clear()
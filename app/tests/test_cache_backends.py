@@ -0,0 +1,91 @@
+import asyncio
+import pytest
+import pytest_asyncio
+
+from app.config import settings
+from app.utils.cache_backends import MemoryCacheBackend, RedisCacheBackend, create_cache_backend
+
+pytestmark = pytest.mark.asyncio
+
+@pytest_asyncio.fixture(params=["memory", "redis"])
+async def backend(request):
+    if request.param == "memory":
+        backend = MemoryCacheBackend()
+    else:
+        backend = RedisCacheBackend()
+        try:
+            await asyncio.wait_for(backend.ping(), timeout=1)
+        except Exception:
+            await backend.close()
+            pytest.skip("Redis недоступен")
+    await backend.flush()
+    yield backend
+    await backend.flush()
+    await backend.close()
+
+async def test_set_get_delete(backend):
+    assert await backend.get("missing") is None
+    await backend.set("key", "value", 60)
+    assert await backend.get("key") == "value"
+    await backend.set("key", "other", 60)
+    assert await backend.get("key") == "other"
+    assert await backend.delete("key", "missing") == 1
+    assert await backend.get("key") is None
+    assert await backend.delete() == 0
+
+async def test_ttl_expiry(backend):
+    await backend.set("short", "value", 1)
+    assert await backend.get("short") == "value"
+    await asyncio.sleep(1.1)
+    assert await backend.get("short") is None
+
+async def test_set_many_with_message(backend):
+    async with backend.subscribe("conformance") as messages:
+        await backend.set_many([("a", "1", 60), ("b", "2", 60)], message=("conformance", "batch"))
+        assert await asyncio.wait_for(messages.__anext__(), timeout=2) == "batch"
+    assert await backend.get("a") == "1"
+    assert await backend.get("b") == "2"
+
+async def test_set_many_only_if_absent(backend):
+    await backend.set("a", "kept", 60)
+    await backend.set_many([("a", "1", 60), ("b", "2", 60)], only_if_absent=True)
+    assert await backend.get("a") == "kept"
+    assert await backend.get("b") == "2"
+
+async def test_publish_subscribe(backend):
+    async with backend.subscribe("conformance") as messages:
+        await backend.publish("conformance", "hello")
+        await backend.publish("other-channel", "ignored")
+        await backend.publish("conformance", "world")
+        received = [await asyncio.wait_for(messages.__anext__(), timeout=2) for _ in range(2)]
+    assert received == ["hello", "world"]
+
+async def test_flush_and_ping(backend):
+    await backend.set("key", "value", 60)
+    await backend.flush()
+    assert await backend.get("key") is None
+    assert await backend.ping()
+
+async def test_unknown_backend():
+    with pytest.raises(ValueError):
+        create_cache_backend("memcached")
+
+async def test_memory_backend_refuses_several_workers(monkeypatch):
+    monkeypatch.setattr(settings, "WEB_CONCURRENCY", 4)
+    with pytest.raises(ValueError, match="WEB_CONCURRENCY"):
+        create_cache_backend("memory")
+    monkeypatch.setattr(settings, "WEB_CONCURRENCY", 1)
+    assert isinstance(create_cache_backend("memory"), MemoryCacheBackend)
+
+async def test_memory_backend_evicts_oldest_at_capacity(monkeypatch):
+    monkeypatch.setattr(settings, "MEMORY_CACHE_MAX_ENTRIES", 3)
+    backend = MemoryCacheBackend()
+    for key in ("a", "b", "c"):
+        await backend.set(key, key, 60)
+    # перезапись существующего ключа никого не вытесняет
+    await backend.set("a", "a2", 60)
+    assert len(backend) == 3
+    await backend.set("d", "d", 60)
+    assert await backend.get("b") is None
+    assert await backend.get("a") == "a2"
+    assert len(backend) == 3
@@ -1,11 +1,18 @@
+import asyncio
+import json
 import pytest
 import pytest_asyncio
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
-from app.database import Base
+from app.config import settings
+from app.database import Base, RequestDBRouting, make_session_factory, request_db_routing
 from app import crud, models, schemas
+from app.importer.bulk import BulkImporter
+from app.utils.cache import get_cache, get_cached_link
+from app.utils.hll import HyperLogLog, visitor_fingerprint
+from app.utils.shortcode import short_code_allocator, short_code_encoder
 
 DATABASE_URL = "sqlite+aiosqlite:///:memory:"
 
@@ -31,6 +38,8 @@ async def db() -> AsyncSession:
         await session.close()
         async with engine_test.begin() as conn:
             await conn.run_sync(Base.metadata.drop_all)
+        # блок id зарезервирован в этой базе, в общей тестовой базе он недействителен
+        short_code_allocator.reset()
 
 @pytest.mark.asyncio
 async def test_create_and_get_user(db: AsyncSession):
@@ -41,7 +50,7 @@ async def test_create_and_get_user(db: AsyncSession):
     assert user_fetched.id == user.id
 
 def test_generate_short_code_without_custom_alias():
-    short_code = crud.generate_short_code()
+    short_code = crud.generate_short_code(code_id=1)
     assert short_code.startswith("hse")
     assert len(short_code) == 9
 
@@ -96,3 +105,212 @@ async def test_search_link_by_original_url(db: AsyncSession):
     link = await crud.create_link(db, link_in, owner_id=5)
     results = await crud.search_link_by_original_url(db, url)
     assert any(l.id == link.id for l in results)
+
+@pytest.mark.asyncio
+async def test_apply_redirect_deltas(db: AsyncSession):
+    link_in = schemas.LinkCreate(original_url="https://habr.com", expires_at=None, custom_alias="delta123")
+    link = await crud.create_link(db, link_in, owner_id=6)
+    accessed_at = datetime.utcnow()
+    await crud.apply_redirect_deltas(db, [("delta123", 5, accessed_at), ("missing", 3, accessed_at)])
+    await crud.apply_redirect_deltas(db, [("delta123", 2, accessed_at)])
+    await db.refresh(link)
+    assert link.redirect_count == 7
+    assert link.last_accessed_at is not None
+
+@pytest.mark.asyncio
+async def test_read_replica_routing(tmp_path):
+    primary = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'primary.db'}")
+    replica = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'replica.db'}")
+    for engine, url in ((primary, "https://primary.example.com"), (replica, "https://replica.example.com")):
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.execute(models.Link.__table__.insert().values(short_code="routed", original_url=url))
+    factory = make_session_factory(primary, [replica])
+    try:
+        async with factory() as session:
+            assert (await crud.get_link_by_short_code(session, "routed")).original_url == "https://replica.example.com"
+        async with factory() as session:
+            link = await crud.get_link_by_short_code(session, "routed", use_replica=False)
+            assert link.original_url == "https://primary.example.com"
+
+        routing = RequestDBRouting()
+        token = request_db_routing.set(routing)
+        try:
+            async with factory() as session:
+                await crud.create_user(session, schemas.UserCreate(username="routed", password="secret"))
+                # после записи сессия читает свои данные с primary
+                assert await crud.get_user_by_username(session, "routed") is not None
+            assert routing.wrote
+        finally:
+            request_db_routing.reset(token)
+
+        token = request_db_routing.set(RequestDBRouting(force_primary=True))
+        try:
+            async with factory() as session:
+                assert (await crud.get_link_by_short_code(session, "routed")).original_url == "https://primary.example.com"
+        finally:
+            request_db_routing.reset(token)
+    finally:
+        await primary.dispose()
+        await replica.dispose()
+
+@pytest.mark.asyncio
+async def test_bulk_import_rejects_bad_rows_and_resumes(tmp_path, session_factory):
+    source = tmp_path / "links.jsonl"
+    records = [
+        {"original_url": "https://import.example.com/1"},
+        {"original_url": "not a url"},
+        {"original_url": "https://import.example.com/2", "custom_alias": "importAlias"},
+        {"original_url": "https://import.example.com/3", "custom_alias": "importAlias"},
+        {"original_url": "https://import.example.com/4"},
+    ]
+    source.write_text("\n".join(json.dumps(record) for record in records) + "\n\n{broken\n")
+
+    class Interrupted(Exception):
+        pass
+
+    def interrupt(report):
+        raise Interrupted
+
+    # о кодах пачки воркеры узнают до того, как она отмечена в чекпоинте
+    async with get_cache().subscribe(settings.CACHE_INVALIDATION_CHANNEL) as messages:
+        with pytest.raises(Interrupted):
+            await BulkImporter(
+                session_factory, chunk_size=2, cache_fill=False, progress=interrupt
+            ).run(str(source), job_id="import-test")
+        announced = json.loads(await asyncio.wait_for(messages.__anext__(), timeout=1))
+    async with session_factory() as db:
+        first = await crud.search_link_by_original_url(db, "https://import.example.com/1")
+    assert announced["short_codes"] == [first[0].short_code]
+    report = await BulkImporter(session_factory, chunk_size=2).run(str(source), job_id="import-test")
+    assert report.resumed_from == 2
+    assert report.records == 4
+    assert report.imported == 3
+    assert report.rejected == 3
+    assert {rejection["line"] for rejection in report.rejections} == {4, 7}
+
+    async with session_factory() as db:
+        links = await crud.search_link_by_original_url(db, "https://import.example.com/4")
+        assert len(links) == 1
+        assert (await crud.get_link_by_short_code(db, "importAlias")).original_url == "https://import.example.com/2"
+        checkpoint = await crud.get_import_checkpoint(db, "import-test")
+    assert checkpoint.finished_at is not None
+    assert checkpoint.records_done == 6
+    assert (await get_cached_link(links[0].short_code))["original_url"] == "https://import.example.com/4"
+
+    again = await BulkImporter(session_factory, chunk_size=2).run(str(source), job_id="import-test")
+    assert again.records == 0
+    assert again.imported == 3
+
+@pytest.mark.asyncio
+async def test_bulk_insert_links_skips_foreign_rows_with_same_code(db: AsyncSession):
+    existing = await crud.create_link(
+        db, schemas.LinkCreate(original_url="https://bulk.example.com", custom_alias="bulkTaken"), owner_id=1
+    )
+    now = datetime.now(timezone.utc)
+    rows = [
+        {
+            "original_url": "https://bulk.example.com", "url_hash": None, "short_code": "bulkTaken",
+            "expires_at": None, "owner_id": 2, "created_at": now, "redirect_count": 0
+        },
+        {
+            "original_url": "https://bulk.example.com/new", "url_hash": None, "short_code": "bulkNew",
+            "expires_at": None, "owner_id": 2, "created_at": now, "redirect_count": 0
+        },
+    ]
+    assert await crud.bulk_insert_links(db, rows) == ["bulkNew"]
+    await db.commit()
+    assert (await crud.get_link_by_short_code(db, "bulkTaken")).owner_id == existing.owner_id
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("native_upsert", [True, False])
+async def test_click_rollups_accumulate_with_and_without_native_upsert(db: AsyncSession, monkeypatch, native_upsert):
+    if not native_upsert:
+        monkeypatch.setattr(crud, "_dialect_insert", lambda db, table: None)
+    short_code = f"rollup{native_upsert}"
+    hour = datetime(2026, 1, 1, 10, tzinfo=timezone.utc)
+    day = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    for _ in range(2):
+        await crud.store_click_events(db, [], [(short_code, "hour", hour, 3), (short_code, "day", day, 3)])
+    rows = await crud.get_click_rollups(db, short_code, "hour", day)
+    assert [clicks for _, clicks in rows] == [6]
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("native_upsert", [True, False])
+async def test_visitor_sketches_merge_with_and_without_native_upsert(db: AsyncSession, monkeypatch, native_upsert):
+    if not native_upsert:
+        monkeypatch.setattr(crud, "_dialect_insert", lambda db, table: None)
+    short_code = f"sketch{native_upsert}"
+    day = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    for visitors in (range(0, 50), range(25, 100)):
+        sketch = HyperLogLog()
+        for visitor in visitors:
+            sketch.add_hash(visitor_fingerprint(f"10.0.0.{visitor}", "agent"))
+        await crud.store_click_events(db, [], [], {(short_code, day): sketch})
+    assert await crud.count_unique_visitors(db, short_code, day) == pytest.approx(100, rel=0.1)
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("expired", [False, True])
+async def test_recreated_alias_starts_with_empty_stats(db: AsyncSession, expired):
+    alias = f"reborn{expired}"
+    day = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    expires_at = datetime.now(timezone.utc) - timedelta(days=1) if expired else None
+    link = await crud.create_link(db, schemas.LinkCreate(original_url="https://old.example.com", custom_alias=alias), owner_id=1)
+    link.expires_at = expires_at
+    await db.commit()
+    db.expunge(link)
+    sketch = HyperLogLog()
+    sketch.add_hash(visitor_fingerprint("10.0.0.1", "agent"))
+    await crud.store_click_events(
+        db, [(alias, day, None, "agent", None)], [(alias, "hour", day, 1), (alias, "day", day, 1)], {(alias, day): sketch}
+    )
+
+    if expired:
+        assert alias in await crud.delete_expired_links(db, datetime.now(timezone.utc), 100)
+    else:
+        assert await crud.delete_link(db, alias) is not None
+    await crud.create_link(db, schemas.LinkCreate(original_url="https://new.example.com", custom_alias=alias), owner_id=2)
+
+    assert await crud.get_click_rollups(db, alias, "hour", day) == []
+    assert await crud.count_unique_visitors(db, alias, day) == 0
+    events = (await db.execute(
+        models.ClickEvent.__table__.select().where(models.ClickEvent.short_code == alias)
+    )).all()
+    assert events == []
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("native_upsert", [True, False])
+async def test_batch_retries_generated_code_collisions(db: AsyncSession, monkeypatch, native_upsert):
+    if not native_upsert:
+        monkeypatch.setattr(crud, "_insert_ignoring_conflicts", lambda db, table: None)
+    taken_id = await short_code_allocator.allocate(db)
+    existing = await crud.create_link(db, schemas.LinkCreate(original_url="https://taken.example.com"), owner_id=1)
+    existing.short_code = short_code_encoder.encode(taken_id)
+    await db.commit()
+    alias_taken = await crud.create_link(
+        db, schemas.LinkCreate(original_url="https://taken.example.com", custom_alias=f"batchTaken{native_upsert}"), owner_id=1
+    )
+    allocate_many = short_code_allocator.allocate_many
+    calls = []
+
+    async def colliding_allocate_many(db, count):
+        calls.append(count)
+        ids = await allocate_many(db, count)
+        return [taken_id] + ids[1:] if len(calls) == 1 else ids
+
+    monkeypatch.setattr(short_code_allocator, "allocate_many", colliding_allocate_many)
+    links = [
+        schemas.LinkCreate(original_url="https://first.example.com"),
+        schemas.LinkCreate(original_url="https://second.example.com"),
+        schemas.LinkCreate(original_url="https://alias.example.com", custom_alias=alias_taken.short_code),
+        schemas.LinkCreate(original_url="https://alias.example.com", custom_alias=f"batchAlias{native_upsert}"),
+    ]
+    results = await crud.create_links_batch(db, links, owner_id=2)
+
+    assert calls == [2, 1]
+    assert [detail for _, detail in results] == [None, None, "Алиас уже занят", None]
+    first, second, _, alias = (link for link, _ in results)
+    assert first.short_code not in (existing.short_code, second.short_code)
+    assert first.original_url == "https://first.example.com" and first.owner_id == 2
+    assert alias.short_code == f"batchAlias{native_upsert}"
+    assert (await crud.get_link_by_short_code(db, existing.short_code)).owner_id == 1
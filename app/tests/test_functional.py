@@ -1,5 +1,23 @@
+import asyncio
+import json
+import logging
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+
 import pytest
 from httpx import AsyncClient
+from sqlalchemy import update
+
+from app import crud, models
+from app.config import settings
+from app.endpoints import auth
+from app.main import cache_warmer
+from app.utils.bloom import ShortCodeFilter, short_code_filter
+from app.utils.cache import cache_link, cache_tombstone, get_cached_link, local_cache
+from app.utils.clicks import click_pipeline
+from app.utils.counters import redirect_counter
+from app.utils.sweeper import ExpiredLinkSweeper
+from app.utils.tracing import slow_traces
 
 pytestmark = pytest.mark.asyncio
 
@@ -90,3 +108,446 @@ async def test_auth_and_links_flow(async_client: AsyncClient):
     link_no_owner = response.json()
     response = await async_client.delete(f"/links/{link_no_owner['short_code']}", headers=headers)
     assert response.status_code == 403, "Удаление ссылки, не принадлежащей пользователю, должно вернуть 403"
+
+async def test_redirect_served_from_cache_record(async_client: AsyncClient, cache):
+    expires_at = (datetime.now(timezone.utc) + timedelta(minutes=5)).isoformat()
+    response = await async_client.post(
+        "/links/shorten",
+        json={"original_url": "https://cached.example.com", "custom_alias": "cachedRec", "expires_at": expires_at}
+    )
+    assert response.status_code == 200, response.text
+
+    cached = await get_cached_link("cachedRec", cache=cache)
+    assert cached["original_url"] == "https://cached.example.com"
+    assert cached["deleted"] is False
+    assert cached["expires_at"] is not None
+
+    expired = dict(cached, expires_at=(datetime.now(timezone.utc) - timedelta(minutes=1)).isoformat())
+    await cache.set("cachedRec", json.dumps(expired), 60)
+    local_cache.pop("cachedRec")
+    response = await async_client.get("/links/cachedRec", follow_redirects=False)
+    assert response.status_code == 410
+
+    await cache_link("cachedRec", {"original_url": None, "expires_at": None, "deleted": True}, expire=60, cache=cache)
+    response = await async_client.get("/links/cachedRec", follow_redirects=False)
+    assert response.status_code == 404
+
+async def test_redirect_counts_are_flushed_in_batches(async_client: AsyncClient):
+    response = await create_short_link(async_client, None, "https://counted.example.com", "countMe")
+    assert response.status_code == 200, response.text
+
+    responses = await asyncio.gather(*[
+        async_client.get("/links/countMe", follow_redirects=False) for _ in range(20)
+    ])
+    assert all(r.status_code in (302, 307) for r in responses)
+
+    stats = (await async_client.get("/links/countMe/stats")).json()
+    assert stats["redirect_count"] == 20
+    assert stats["last_accessed_at"] is not None
+
+    await redirect_counter.flush()
+    assert redirect_counter.pending("countMe") == (0, None)
+    stats = (await async_client.get("/links/countMe/stats")).json()
+    assert stats["redirect_count"] == 20
+
+async def test_click_events_are_rolled_up_for_stats(async_client: AsyncClient):
+    response = await create_short_link(async_client, None, "https://clicked.example.com", "clickMe")
+    assert response.status_code == 200, response.text
+    for _ in range(3):
+        await async_client.get("/links/clickMe", follow_redirects=False, headers={"Referer": "https://ref.example.com"})
+
+    await click_pipeline.flush()
+    assert click_pipeline.pending() == 0
+    stats = (await async_client.get("/links/clickMe/stats")).json()
+    assert stats["granularity"] == "hour"
+    assert len(stats["series"]) == 24
+    assert stats["series"][-1]["clicks"] == 3
+    assert sum(bucket["clicks"] for bucket in stats["series"]) == 3
+    assert stats["unique_visitors"] == 1
+
+    await async_client.get("/links/clickMe", follow_redirects=False, headers={"User-Agent": "another-browser"})
+    await click_pipeline.flush()
+    stats = (await async_client.get("/links/clickMe/stats", params={"granularity": "day", "buckets": 7})).json()
+    assert [bucket["clicks"] for bucket in stats["series"]] == [0] * 6 + [4]
+    assert stats["unique_visitors"] == 2
+
+async def test_trending_links(async_client: AsyncClient):
+    for alias, clicks in (("trendHot", 5), ("trendWarm", 2)):
+        response = await create_short_link(async_client, None, f"https://{alias}.example.com", alias)
+        assert response.status_code == 200, response.text
+        for _ in range(clicks):
+            await async_client.get(f"/links/{alias}", follow_redirects=False)
+
+    response = await async_client.get("/links/trending", params={"window": "5m", "limit": 50})
+    assert response.status_code == 200, response.text
+    codes = [link["short_code"] for link in response.json()["links"]]
+    assert codes.index("trendHot") < codes.index("trendWarm")
+
+    response = await async_client.get("/links/trending", params={"window": "7y"})
+    assert response.status_code == 400
+
+async def test_expired_links_are_swept(async_client: AsyncClient, cache, session_factory):
+    now = datetime.now(timezone.utc)
+    expiry = {"sweepOld": now - timedelta(days=2), "sweepFresh": now - timedelta(minutes=1), "sweepNever": None}
+    for alias, expires_at in expiry.items():
+        response = await create_short_link(async_client, None, "https://swept.example.com", alias)
+        assert response.status_code == 200, response.text
+        async with session_factory() as db:
+            await db.execute(
+                update(models.Link).where(models.Link.short_code == alias).values(expires_at=expires_at)
+            )
+            await db.commit()
+    assert await cache.get("sweepOld") is not None
+
+    sweeper = ExpiredLinkSweeper(session_factory, batch_size=1, pause=0, enabled=True)
+    assert await sweeper.sweep(now=now) == 1
+    assert sweeper.stats()["last_pass_deleted"] == 1
+    assert await cache.get("sweepOld") is None
+    assert await cache.get("sweepFresh") is not None
+    async with session_factory() as db:
+        assert await crud.get_link_by_short_code(db, "sweepOld") is None
+        assert await crud.get_link_by_short_code(db, "sweepFresh") is not None
+        assert await crud.get_link_by_short_code(db, "sweepNever") is not None
+
+    response = await async_client.get("/links/sweepOld", follow_redirects=False)
+    assert response.status_code == 404
+
+async def test_cache_warmup_and_readiness(async_client: AsyncClient, cache, session_factory, monkeypatch):
+    response = await create_short_link(async_client, None, "https://warm.example.com", "warmMe")
+    assert response.status_code == 200, response.text
+    await async_client.get("/links/warmMe", follow_redirects=False)
+    response = await create_short_link(async_client, None, "https://warm.example.com/gone", "warmGone")
+    assert response.status_code == 200, response.text
+    await async_client.get("/links/warmGone", follow_redirects=False)
+    await redirect_counter.flush()
+    await cache.flush()
+    local_cache.clear()
+    # ссылку удалили после снимка прогрева: tombstone не должен быть перезаписан
+    await cache_tombstone("warmGone", cache=cache)
+
+    monkeypatch.setattr(cache_warmer, "session_factory", session_factory)
+    monkeypatch.setattr(cache_warmer, "enabled", True)
+    monkeypatch.setattr(cache_warmer, "ready", False)
+    assert (await async_client.get("/ready")).status_code == 503
+
+    cache_warmer.start()
+    await cache_warmer._task
+    assert cache_warmer.warmed >= 1
+    assert await cache.get("warmMe") is not None
+    assert json.loads(await cache.get("warmGone"))["deleted"] is True
+    response = await async_client.get("/ready")
+    assert response.status_code == 200
+    assert response.json()["status"] == "ready"
+
+async def test_concurrent_cache_misses_are_coalesced(async_client: AsyncClient, cache, monkeypatch):
+    response = await create_short_link(async_client, None, "https://herd.example.com", "herdCode")
+    assert response.status_code == 200, response.text
+    await cache.flush()
+    local_cache.clear()
+
+    calls = 0
+    original = crud.get_link_by_short_code
+
+    async def slow_lookup(db, short_code):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return await original(db, short_code)
+
+    monkeypatch.setattr(crud, "get_link_by_short_code", slow_lookup)
+    responses = await asyncio.gather(*[
+        async_client.get("/links/herdCode", follow_redirects=False) for _ in range(30)
+    ])
+    assert all(r.status_code in (302, 307) for r in responses)
+    assert calls == 1
+
+async def test_unknown_codes_are_negatively_cached_and_filtered(async_client: AsyncClient, session_factory, monkeypatch):
+    calls = 0
+    original = crud.get_link_by_short_code
+
+    async def counting_lookup(db, short_code):
+        nonlocal calls
+        calls += 1
+        return await original(db, short_code)
+
+    monkeypatch.setattr(crud, "get_link_by_short_code", counting_lookup)
+    for _ in range(3):
+        response = await async_client.get("/links/noSuchCode", follow_redirects=False)
+        assert response.status_code == 404
+    assert calls == 1
+
+    monkeypatch.setattr(short_code_filter, "enabled", True)
+    monkeypatch.setattr(short_code_filter, "session_factory", session_factory)
+    await short_code_filter.build()
+    try:
+        response = await async_client.get("/links/neverCreated", follow_redirects=False)
+        assert response.status_code == 404
+        assert calls == 1
+        assert short_code_filter.rejected >= 1
+
+        response = await create_short_link(async_client, None, "https://bloom.example.com", "bloomCode")
+        assert response.status_code == 200
+        assert short_code_filter.might_exist("bloomCode")
+    finally:
+        short_code_filter.ready = False
+
+async def test_short_code_filter_build_errors_and_races(session_factory, caplog):
+    code_filter = ShortCodeFilter(enabled=True)
+    builds = []
+
+    @asynccontextmanager
+    async def racing_session():
+        builds.append(len(builds) + 1)
+        async with session_factory() as db:
+            code_filter.add(f"midBuild{len(builds)}")
+            if len(builds) == 1:
+                # подписка на инвалидации прервалась посреди первого построения
+                code_filter.mark_stale()
+            yield db
+
+    code_filter.session_factory = racing_session
+    code_filter.start_build()
+    for _ in range(200):
+        if code_filter.ready:
+            break
+        await asyncio.sleep(0.01)
+    assert builds == [1, 2]
+    assert code_filter.ready
+    assert code_filter.might_exist("midBuild2")
+
+    def broken_session():
+        raise ConnectionError("база недоступна")
+
+    code_filter.session_factory = broken_session
+    with caplog.at_level(logging.ERROR, logger="app.utils.bloom"):
+        code_filter.start_build()
+        await asyncio.wait([code_filter._build_task])
+        await asyncio.sleep(0)
+    assert not code_filter.ready
+    assert code_filter.might_exist("anything")
+    assert "Не удалось построить Bloom-фильтр" in caplog.text
+    await code_filter.close()
+
+async def test_zero_negative_ttl_disables_tombstones(async_client: AsyncClient, cache, monkeypatch):
+    monkeypatch.setattr(settings, "NEGATIVE_CACHE_TTL", 0)
+    response = await async_client.get("/links/noTombstone", follow_redirects=False)
+    assert response.status_code == 404
+    assert await get_cached_link("noTombstone", cache=cache) is None
+
+    await cache_link("zeroTtl", {"original_url": "https://zero.example.com", "expires_at": None}, expire=0, cache=cache)
+    assert await get_cached_link("zeroTtl", cache=cache) is None
+
+async def test_custom_alias_conflicts_are_rejected(async_client: AsyncClient):
+    response = await create_short_link(async_client, None, "https://first.example.com", "takenAlias")
+    assert response.status_code == 200
+    response = await create_short_link(async_client, None, "https://second.example.com", "takenAlias")
+    assert response.status_code == 400
+    response = await create_short_link(async_client, None, "https://third.example.com", "hseAbc123")
+    assert response.status_code == 400
+    for alias in ("trending", "search", "shorten"):
+        response = await create_short_link(async_client, None, "https://route.example.com", alias)
+        assert response.status_code == 422
+
+async def test_batch_shorten_reports_per_item_results(async_client: AsyncClient):
+    response = await create_short_link(async_client, None, "https://existing.example.com", "batchTaken")
+    assert response.status_code == 200
+
+    items = [
+        {"original_url": "https://batch.example.com/1"},
+        {"original_url": "https://batch.example.com/2", "custom_alias": "batchTaken"},
+        {"original_url": "https://batch.example.com/3", "custom_alias": "batchFresh"},
+        {"original_url": "https://batch.example.com/4", "custom_alias": "batchFresh"},
+        {"original_url": "https://batch.example.com/5"},
+    ]
+    response = await async_client.post("/links/shorten/batch", json={"items": items})
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert data["created"] == 3 and data["failed"] == 2
+    statuses = [item["status"] for item in data["results"]]
+    assert statuses == ["created", "conflict", "created", "conflict", "created"]
+    assert data["results"][2]["link"]["short_code"] == "batchFresh"
+
+    for item in data["results"]:
+        if item["status"] == "created":
+            redirect = await async_client.get(f"/links/{item['link']['short_code']}", follow_redirects=False)
+            assert redirect.status_code in (302, 307)
+            assert redirect.headers["location"] == items[item["index"]]["original_url"]
+
+    response = await async_client.post("/links/shorten/batch", json={"items": []})
+    assert response.status_code == 422
+
+async def test_search_uses_normalized_url_and_keyset_pages(async_client: AsyncClient):
+    for i in range(5):
+        response = await create_short_link(async_client, None, "https://Paged.Example.com:443/path#frag")
+        assert response.status_code == 200
+
+    seen = []
+    cursor = None
+    while True:
+        params = {"original_url": "https://paged.example.com/path", "limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        response = await async_client.get("/links/search", params=params)
+        assert response.status_code == 200, response.text
+        page = response.json()
+        assert len(page) <= 2
+        seen.extend(link["short_code"] for link in page)
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert len(seen) == len(set(seen)) == 5
+
+    for original_url in ("http://a:99999/x", "http://a:abc/x"):
+        response = await async_client.get("/links/search", params={"original_url": original_url})
+        assert response.status_code == 404
+
+async def test_token_principal_cache_and_revocation(async_client: AsyncClient, monkeypatch):
+    assert (await register_user(async_client, "revokeuser", "oldpass")).status_code == 200
+    token = (await login_user(async_client, "revokeuser", "oldpass")).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    assert (await async_client.get("/auth/me", headers=headers)).status_code == 200
+
+    async def no_db_lookup(*args, **kwargs):
+        raise AssertionError("Проверка закэшированного токена не должна ходить в базу")
+
+    with monkeypatch.context() as patched:
+        patched.setattr(auth, "get_user_by_id", no_db_lookup)
+        patched.setattr(crud, "get_user_by_id", no_db_lookup)
+        response = await async_client.get("/auth/me", headers=headers)
+        assert response.status_code == 200
+        assert response.json()["username"] == "revokeuser"
+
+    response = await async_client.put(
+        "/auth/me/password",
+        json={"old_password": "oldpass", "new_password": "newpass"},
+        headers=headers
+    )
+    assert response.status_code == 200, response.text
+    new_headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    assert (await async_client.get("/auth/me", headers=headers)).status_code == 401
+    assert (await async_client.get("/auth/me", headers=new_headers)).status_code == 200
+    assert (await login_user(async_client, "revokeuser", "oldpass")).status_code == 401
+
+    assert (await async_client.delete("/auth/me", headers=new_headers)).status_code == 204
+    assert (await async_client.get("/auth/me", headers=new_headers)).status_code == 401
+
+async def test_cached_redirect_opens_no_db_session(async_client: AsyncClient, monkeypatch):
+    monkeypatch.setattr(settings, "DB_STATS_HEADERS", True)
+    # проверяем именно обработчик роутера, а не быстрый путь
+    monkeypatch.setattr(settings, "REDIRECT_FAST_PATH", False)
+
+    response = await create_short_link(async_client, None, "https://lazy.example.com", "lazySession")
+    assert response.status_code == 200
+    assert int(response.headers["x-db-sessions"]) == 1
+    assert int(response.headers["x-db-queries"]) >= 1
+
+    response = await async_client.get("/links/lazySession", follow_redirects=False)
+    assert response.status_code in (302, 307)
+    assert response.headers["x-db-sessions"] == "0"
+    assert response.headers["x-db-queries"] == "0"
+
+async def test_redirect_fast_path_serves_cache_hits(async_client: AsyncClient, cache, monkeypatch):
+    monkeypatch.setattr(settings, "DB_STATS_HEADERS", True)
+
+    response = await create_short_link(async_client, None, "https://fast.example.com/путь?q=1", "fastPath")
+    assert response.status_code == 200, response.text
+
+    response = await async_client.get("/links/fastPath", follow_redirects=False)
+    assert response.status_code == 307
+    assert response.headers["location"] == "https://fast.example.com/%D0%BF%D1%83%D1%82%D1%8C?q=1"
+    # ответ не прошёл через DBStatsMiddleware и роутер
+    assert "x-db-sessions" not in response.headers
+    assert redirect_counter.pending("fastPath")[0] == 1
+
+    # промах кэша и неизвестные коды обслуживает обычный обработчик
+    await cache.flush()
+    local_cache.clear()
+    response = await async_client.get("/links/fastPath", follow_redirects=False)
+    assert response.status_code == 307
+    assert response.headers["x-db-sessions"] == "1"
+    response = await async_client.get("/links/fastPathMissing", follow_redirects=False)
+    assert response.status_code == 404
+    response = await async_client.get("/links/trending")
+    assert response.status_code == 200
+
+async def test_metrics_endpoint(async_client: AsyncClient):
+    response = await create_short_link(async_client, None, "https://metrics.example.com", "metricsMe")
+    assert response.status_code == 200, response.text
+    for _ in range(2):
+        await async_client.get("/links/metricsMe", follow_redirects=False)
+
+    response = await async_client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+    assert 'shorturler_http_requests_total{method="GET",route="/links/{short_code}",status="307"}' in text
+    assert 'shorturler_http_request_duration_seconds_bucket{method="POST",route="/links/shorten",le="+Inf"}' in text
+    assert 'shorturler_cache_requests_total{layer="local",result="hit"}' in text
+    assert 'shorturler_db_queries_total{statement="insert"}' in text
+    assert "shorturler_http_requests_in_flight 1" in text
+
+async def test_slow_request_trace_and_profiler(async_client: AsyncClient, monkeypatch):
+    monkeypatch.setattr(settings, "TRACE_SLOW_REQUEST_MS", 0.001)
+    monkeypatch.setattr(settings, "ADMIN_TOKEN", "admin-secret")
+    slow_traces.clear()
+    response = await create_short_link(async_client, None, "https://trace.example.com", "traceMe")
+    assert response.status_code == 200, response.text
+
+    response = await async_client.get("/admin/traces")
+    assert response.status_code == 403
+    response = await async_client.get("/admin/traces", headers={"X-Admin-Token": "admin-secret"})
+    assert response.status_code == 200
+    trace = next(item for item in response.json()["traces"] if item["path"] == "/links/shorten")
+    names = [item["name"] for item in trace["spans"]]
+    assert "crud.create_link" in names
+    assert "sql.insert" in names
+    assert "cache.cache_link" in names
+
+    response = await async_client.get(
+        "/admin/profile", params={"seconds": 0.2, "interval_ms": 5}, headers={"X-Admin-Token": "admin-secret"}
+    )
+    assert response.status_code == 200
+    lines = response.text.splitlines()
+    assert lines
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+    response = await async_client.get(
+        "/admin/profile", params={"seconds": 3600}, headers={"X-Admin-Token": "admin-secret"}
+    )
+    assert response.status_code == 400
+
+async def test_my_links_keyset_pages_and_ndjson_export(async_client: AsyncClient, monkeypatch):
+    await register_user(async_client, "exporter", "exportpass")
+    token = (await login_user(async_client, "exporter", "exportpass")).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    codes = []
+    for i in range(5):
+        response = await create_short_link(async_client, token, f"https://export.example.com/{i}", f"export{i}")
+        assert response.status_code == 200, response.text
+        codes.append(response.json()["short_code"])
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2}
+        if cursor is not None:
+            params["cursor"] = cursor
+        response = await async_client.get("/auth/me/links", params=params, headers=headers)
+        assert response.status_code == 200
+        seen.extend(item["short_code"] for item in response.json())
+        cursor = response.headers.get("x-next-cursor")
+        if cursor is None:
+            break
+    assert seen == codes
+
+    monkeypatch.setattr(settings, "LINKS_EXPORT_CHUNK_SIZE", 2)
+    response = await async_client.get("/auth/me/links/export", headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["short_code"] for row in rows] == codes
+    assert rows[0]["original_url"] == "https://export.example.com/0"
+    assert rows[0]["redirect_count"] == 0
+
+    response = await async_client.get("/auth/me/links/export")
+    assert response.status_code == 401
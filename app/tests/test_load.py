@@ -3,6 +3,13 @@ import time
 import pytest
 from httpx import AsyncClient
 
+from app.benchmarks.compare import compare_reports
+from app.benchmarks.workload import BenchmarkConfig, run_benchmark
+from app.config import settings
+from app.utils.cache import get_cache, local_cache
+from app.utils.metrics import http_requests
+from app.utils.shortcode import ShortCodeAllocator, short_code_encoder
+
 CONCURRENT_REQUESTS = 200
 RESPONSE_TIME_THRESHOLD = 0.5
 
@@ -51,3 +58,116 @@ async def test_load_redirect(async_client: AsyncClient):
 
     assert failure_count == 0, "Некоторые запросы завершились ошибкой"
     assert avg_time < RESPONSE_TIME_THRESHOLD, f"Среднее время ответа слишком велико: {avg_time:.4f} секунд"
+
+ALLOCATION_WORKERS = 50
+ALLOCATIONS_PER_WORKER = 2000
+
+@pytest.mark.asyncio
+async def test_short_code_allocation_throughput(session_factory):
+    allocator = ShortCodeAllocator(block_size=1000, counter_name="benchmark")
+
+    async def worker():
+        async with session_factory() as db:
+            return [short_code_encoder.encode(await allocator.allocate(db)) for _ in range(ALLOCATIONS_PER_WORKER)]
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*[worker() for _ in range(ALLOCATION_WORKERS)])
+    elapsed = time.perf_counter() - start
+
+    codes = [code for batch in results for code in batch]
+    total = ALLOCATION_WORKERS * ALLOCATIONS_PER_WORKER
+    print(f"Short code allocation benchmark:")
+    print(f"  Concurrent workers: {ALLOCATION_WORKERS}")
+    print(f"  Codes allocated: {total}")
+    print(f"  Block reservations: {allocator.reservations}")
+    print(f"  Throughput: {total / elapsed:.0f} codes/sec")
+
+    assert len(set(codes)) == total, "Выданы повторяющиеся коды"
+    assert allocator.reservations == total // 1000
+
+FAST_PATH_REQUESTS = 1000
+
+@pytest.mark.asyncio
+async def test_redirect_fast_path_throughput(async_client: AsyncClient, monkeypatch):
+    create_resp = await async_client.post("/links/shorten", json={"original_url": "https://example.com/fastpath"})
+    assert create_resp.status_code == 200, create_resp.text
+    short_code = create_resp.json()["short_code"]
+
+    async def measure() -> float:
+        start = time.perf_counter()
+        for _ in range(FAST_PATH_REQUESTS):
+            response = await async_client.get(f"/links/{short_code}", follow_redirects=False)
+            assert response.status_code == 307
+            assert response.headers["location"] == "https://example.com/fastpath"
+        return FAST_PATH_REQUESTS / (time.perf_counter() - start)
+
+    monkeypatch.setattr(settings, "REDIRECT_FAST_PATH", False)
+    await measure()
+    router_rps = await measure()
+    monkeypatch.setattr(settings, "REDIRECT_FAST_PATH", True)
+    fast_rps = await measure()
+
+    print(f"Redirect fast path benchmark ({FAST_PATH_REQUESTS} cached redirects):")
+    print(f"  FastAPI router: {router_rps:.0f} req/sec")
+    print(f"  ASGI fast path: {fast_rps:.0f} req/sec ({fast_rps / router_rps:.1f}x)")
+    # скорость только печатается: соотношение на общем CI-раннере слишком шумное для assert
+
+@pytest.mark.asyncio
+async def test_benchmark_suite_smoke(async_client: AsyncClient, session_factory, monkeypatch):
+    monkeypatch.setattr(settings, "DB_STATS_HEADERS", True)
+
+    evicted = []
+
+    async def evict(short_code):
+        evicted.append(short_code)
+        local_cache.pop(short_code)
+        await get_cache().delete(short_code)
+
+    config = BenchmarkConfig(links=2000, requests=300, concurrency=1, scenarios=["mixed", "redirect_cold"])
+    report = await run_benchmark(async_client, session_factory, config, evict=evict)
+    mixed = report["scenarios"]["mixed"]
+    print(f"Benchmark suite smoke run: {mixed['throughput_rps']} req/sec, p99 {mixed['p99_ms']} ms")
+
+    assert mixed["requests"] == 300
+    assert mixed["errors"] == 0
+    assert {"redirect", "stats", "create"} <= set(mixed["operations"])
+    assert mixed["p50_ms"] <= mixed["p95_ms"] <= mixed["p99_ms"]
+    # холодный сценарий действительно ходит мимо кэша на каждом переходе
+    cold = report["scenarios"]["redirect_cold"]
+    assert len(evicted) == cold["requests"] == 300
+    assert cold["errors"] == 0
+    assert cold["db_queries_per_request"] >= 1
+    assert compare_reports(report, report) == []
+
+METRICS_REQUESTS = 1000
+
+@pytest.mark.asyncio
+async def test_metrics_overhead(async_client: AsyncClient, monkeypatch):
+    create_resp = await async_client.post("/links/shorten", json={"original_url": "https://example.com/metrics"})
+    assert create_resp.status_code == 200, create_resp.text
+    short_code = create_resp.json()["short_code"]
+
+    async def measure() -> float:
+        start = time.perf_counter()
+        for _ in range(METRICS_REQUESTS):
+            response = await async_client.get(f"/links/{short_code}", follow_redirects=False)
+            assert response.status_code == 307
+        return (time.perf_counter() - start) / METRICS_REQUESTS
+
+    def redirects_counted() -> float:
+        return http_requests.values.get(("GET", "/links/{short_code}", "307"), 0)
+
+    monkeypatch.setattr(settings, "METRICS_ENABLED", False)
+    await measure()
+    counted = redirects_counted()
+    without_metrics = min([await measure() for _ in range(3)])
+    assert redirects_counted() == counted
+    monkeypatch.setattr(settings, "METRICS_ENABLED", True)
+    with_metrics = min([await measure() for _ in range(3)])
+    assert redirects_counted() == counted + 3 * METRICS_REQUESTS
+
+    overhead = with_metrics - without_metrics
+    print(f"Metrics overhead on cached redirects ({METRICS_REQUESTS} requests):")
+    print(f"  Without metrics: {without_metrics * 1e6:.0f} us/request")
+    print(f"  With metrics: {with_metrics * 1e6:.0f} us/request ({overhead * 1e6:+.0f} us)")
+    # накладные расходы только печатаются: замеры на общем CI-раннере слишком шумные для assert
@@ -2,7 +2,11 @@ import pytest
 import pytest_asyncio
 from httpx import AsyncClient
 from app.main import app
+from app import initial_db
+from app.database import Base
 from app.initial_db import init_db
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
 import runpy
 from unittest.mock import patch
 
@@ -26,6 +30,23 @@ async def test_init_db():
     except Exception as e:
         pytest.fail(f"init_db() вызвал исключение: {e}")
 
+@pytest.mark.asyncio
+async def test_init_db_requires_migration(tmp_path, monkeypatch):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'old.db'}")
+    monkeypatch.setattr(initial_db, "engine", engine)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(text("DROP INDEX ix_links_owner_id_id"))
+    try:
+        with pytest.raises(RuntimeError, match="ix_links_owner_id_id"):
+            await init_db()
+        async with engine.begin() as conn:
+            await conn.run_sync(initial_db.upgrade_schema)
+            assert await conn.run_sync(initial_db.missing_schema) == []
+        await init_db()
+    finally:
+        await engine.dispose()
+
 def test_uvicorn_run_called():
     with patch("uvicorn.run") as mock_run:
         runpy.run_module("app.main", run_name="__main__")
@@ -0,0 +1,165 @@
+import asyncio
+import hashlib
+import logging
+import math
+from typing import Optional
+
+from sqlalchemy import func, select
+
+from app import models
+from app.config import settings
+from app.database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+class CountingBloomFilter:
+    """
+    Bloom-фильтр со счётчиками (1 байт на ячейку), поэтому поддерживает удаление
+    """
+    def __init__(self, capacity: int, error_rate: float):
+        capacity = max(capacity, 1)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))), 8)
+        self.hashes = max(int(round(self.size / capacity * math.log(2))), 1)
+        self.count = 0
+        self._counters = bytearray(self.size)
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key: str):
+        for pos in self._positions(key):
+            if self._counters[pos] < 255:
+                self._counters[pos] += 1
+        self.count += 1
+
+    def remove(self, key: str):
+        positions = self._positions(key)
+        if not all(self._counters[pos] for pos in positions):
+            return
+        for pos in positions:
+            # насыщенный счётчик уже нельзя честно уменьшать
+            if self._counters[pos] < 255:
+                self._counters[pos] -= 1
+        self.count = max(self.count - 1, 0)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._counters[pos] for pos in self._positions(key))
+
+    def estimated_error_rate(self) -> float:
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+    def stats(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "items": self.count,
+            "target_error_rate": self.error_rate,
+            "estimated_error_rate": round(self.estimated_error_rate(), 6),
+            "counters": self.size,
+            "hashes": self.hashes,
+            "memory_bytes": len(self._counters)
+        }
+
+class ShortCodeFilter:
+    """
+    Множество всех существующих short_code воркера. Пока фильтр не построен
+    (или устарел), считается, что существовать может любой код
+    """
+    def __init__(self, session_factory=SessionLocal, enabled: bool = None):
+        self.session_factory = session_factory
+        self.enabled = settings.BLOOM_FILTER_ENABLED if enabled is None else enabled
+        self.ready = False
+        self.rejected = 0
+        self._bloom: Optional[CountingBloomFilter] = None
+        self._build_task: Optional[asyncio.Task] = None
+        self._added_during_build: Optional[list] = None
+        self._stale = False
+
+    async def build(self):
+        self.ready = False
+        self._stale = False
+        # коды, созданные пока идёт построение, не должны потеряться
+        self._added_during_build = []
+        try:
+            async with self.session_factory() as db:
+                total = (await db.execute(select(func.count(models.Link.id)))).scalar() or 0
+                bloom = CountingBloomFilter(
+                    max(settings.BLOOM_FILTER_CAPACITY, int(total * 1.25)),
+                    settings.BLOOM_FILTER_ERROR_RATE
+                )
+                stmt = select(models.Link.short_code).execution_options(yield_per=10000)
+                result = await db.stream_scalars(stmt)
+                async for partition in result.partitions(10000):
+                    for short_code in partition:
+                        bloom.add(short_code)
+            for short_code in self._added_during_build:
+                bloom.add(short_code)
+            self._bloom = bloom
+            # если подписка прервалась во время построения, чужие коды могли не попасть ни в выборку, ни в add
+            self.ready = not self._stale
+        finally:
+            self._added_during_build = None
+        logger.info("Bloom-фильтр short_code построен: %s", self._bloom.stats())
+
+    def start_build(self):
+        if not self.enabled or (self._build_task is not None and not self._build_task.done()):
+            return
+        self._build_task = asyncio.create_task(self.build())
+        self._build_task.add_done_callback(self._build_done)
+
+    def _build_done(self, task: asyncio.Task):
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is not None:
+            self.ready = False
+            logger.error("Не удалось построить Bloom-фильтр short_code, работаем без него", exc_info=error)
+        elif self._stale:
+            self.start_build()
+
+    def mark_stale(self):
+        """
+        Мы могли пропустить создание ссылок в других воркерах — до перестройки фильтр не используем.
+        Идущее построение по окончании перезапустится
+        """
+        self.ready = False
+        self._stale = True
+
+    async def close(self):
+        if self._build_task is not None:
+            self._build_task.cancel()
+            try:
+                await self._build_task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._build_task = None
+
+    def add(self, short_code: str):
+        if self._added_during_build is not None:
+            self._added_during_build.append(short_code)
+        if self._bloom is not None:
+            self._bloom.add(short_code)
+
+    def remove(self, short_code: str):
+        if self.ready:
+            self._bloom.remove(short_code)
+
+    def might_exist(self, short_code: str) -> bool:
+        if not self.enabled or not self.ready:
+            return True
+        if short_code in self._bloom:
+            return True
+        self.rejected += 1
+        return False
+
+    def stats(self) -> dict:
+        stats = {"enabled": self.enabled, "ready": self.ready, "rejected": self.rejected}
+        if self._bloom is not None:
+            stats.update(self._bloom.stats())
+        return stats
+
+short_code_filter = ShortCodeFilter()
@@ -1,18 +1,310 @@
+import asyncio
 import json
-import aioredis
+import logging
+import math
+import os
+import random
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Optional
+
 from app.config import settings
+from app.utils.cache_backends import CacheBackend, create_cache_backend
+from app.utils.principals import principal_cache
+from app.utils.bloom import short_code_filter
+from app.utils.metrics import observe_cache
+from app.utils.tracing import traced
+
+logger = logging.getLogger(__name__)
+
+WORKER_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+_cache: Optional[CacheBackend] = None
+_listener: Optional[asyncio.Task] = None
+
+class LocalCache:
+    """
+    Ограниченный LRU-кэш с TTL в памяти воркера (L1 перед Redis)
+    """
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: str):
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        expires_at, value = item
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value, ttl: float = None):
+        if self.max_entries <= 0:
+            return
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            self._data.pop(key, None)
+            return
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: str):
+        if self._data.pop(key, None) is not None:
+            self.invalidations += 1
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations
+        }
+
+local_cache = LocalCache(settings.LOCAL_CACHE_MAX_ENTRIES, settings.LOCAL_CACHE_TTL)
+
+def handle_invalidation(message: str):
+    try:
+        payload = json.loads(message)
+    except (TypeError, ValueError):
+        return
+    if payload.get("origin") == WORKER_ID:
+        return
+    if payload.get("revoke_user") is not None:
+        principal_cache.revoke(payload["revoke_user"])
+        return
+    short_codes = payload.get("short_codes") or [payload.get("short_code")]
+    for short_code in filter(None, short_codes):
+        local_cache.pop(short_code)
+        # ссылку могли создать в другом воркере; лишний код в фильтре даёт только ложноположительный ответ
+        short_code_filter.add(short_code)
+
+async def _listen_invalidations(cache: CacheBackend):
+    while True:
+        try:
+            async with cache.subscribe(settings.CACHE_INVALIDATION_CHANNEL) as messages:
+                if short_code_filter.enabled and not short_code_filter.ready:
+                    short_code_filter.start_build()
+                async for message in messages:
+                    handle_invalidation(message)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.warning("Подписка на инвалидации кэша прервалась, переподключаемся", exc_info=True)
+            # пока подписки нет, чужие изменения могли пройти мимо
+            local_cache.clear()
+            principal_cache.clear()
+            short_code_filter.mark_stale()
+            await asyncio.sleep(1)
 
-async def cache_link(short_code: str, link_data: dict, expire: int = 3600):
-    async with aioredis.from_url(settings.REDIS_URL, decode_responses=True) as redis:
-        await redis.setex(short_code, expire, json.dumps(link_data))
+async def init_cache():
+    global _cache, _listener
+    if _cache is None:
+        _cache = create_cache_backend()
+    if _listener is None and (
+        local_cache.max_entries > 0 or principal_cache.max_entries > 0 or short_code_filter.enabled
+    ):
+        _listener = asyncio.create_task(_listen_invalidations(_cache))
 
-async def get_cached_link(short_code: str):
-    async with aioredis.from_url(settings.REDIS_URL, decode_responses=True) as redis:
-        data = await redis.get(short_code)
+async def close_cache():
+    global _cache, _listener
+    if _listener is not None:
+        _listener.cancel()
+        try:
+            await _listener
+        except asyncio.CancelledError:
+            pass
+        _listener = None
+    local_cache.clear()
+    if _cache is not None:
+        await _cache.close()
+        _cache = None
+
+def get_cache() -> CacheBackend:
+    """
+    Общий бэкенд кэша на всё время жизни приложения (используется как зависимость)
+    """
+    global _cache
+    if _cache is None:
+        _cache = create_cache_backend()
+    return _cache
+
+def as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+def is_expired(expires_at, now: datetime = None) -> bool:
+    if not expires_at:
+        return False
+    if isinstance(expires_at, str):
+        expires_at = datetime.fromisoformat(expires_at)
+    return as_utc(expires_at) < (now or datetime.now(timezone.utc))
+
+def link_cache_record(db_link) -> dict:
+    """
+    Всё, что нужно для редиректа без обращения к базе
+    """
+    expires_at = as_utc(db_link.expires_at)
+    return {
+        "original_url": db_link.original_url,
+        "expires_at": expires_at.isoformat() if expires_at else None,
+        "deleted": False
+    }
+
+def tombstone_record() -> dict:
+    return {"original_url": None, "expires_at": None, "deleted": True}
+
+def cache_ttl(link_data: dict, default: int = None) -> int:
+    """
+    TTL записи не больше, чем осталось жить самой ссылке. Нулевой TTL — не кэшировать
+    """
+    ttl = settings.CACHE_TTL if default is None else default
+    expires_at = link_data.get("expires_at")
+    if expires_at:
+        left = (as_utc(datetime.fromisoformat(expires_at)) - datetime.now(timezone.utc)).total_seconds()
+        ttl = min(ttl, int(left))
+    return ttl
+
+@traced()
+async def cache_link(short_code: str, link_data: dict, expire: int = None, cache: CacheBackend = None):
+    cache = cache or get_cache()
+    expire = cache_ttl(link_data, expire)
+    if expire <= 0:
+        local_cache.pop(short_code)
+        await cache.delete(short_code)
+        return
+    link_data = dict(link_data, cached_until=round(time.time() + expire, 3))
+    local_cache.set(short_code, link_data, expire)
+    await cache.set(short_code, json.dumps(link_data), expire)
+
+@traced()
+async def cache_links(records: dict, cache: CacheBackend = None, notify: bool = True, only_if_absent: bool = False):
+    """
+    Кладёт пачку записей {short_code: link_data} в кэш одним проходом
+    вместе с сообщением об инвалидации (если notify). only_if_absent — не трогать
+    уже закэшированные ключи (и L1 этого воркера, он заполнится из общего кэша)
+    """
+    if not records:
+        return
+    cache = cache or get_cache()
+    items = []
+    for short_code, link_data in records.items():
+        expire = cache_ttl(link_data)
+        if expire <= 0:
+            continue
+        link_data = dict(link_data, cached_until=round(time.time() + expire, 3))
+        if not only_if_absent:
+            local_cache.set(short_code, link_data, expire)
+        items.append((short_code, json.dumps(link_data), expire))
+    message = None
+    if notify:
+        message = (settings.CACHE_INVALIDATION_CHANNEL, json.dumps({"origin": WORKER_ID, "short_codes": list(records)}))
+    await cache.set_many(items, message=message, only_if_absent=only_if_absent)
+
+def should_refresh_early(link_data: dict, beta: float = None) -> bool:
+    """
+    Вероятностное досрочное обновление (XFetch): чем ближе конец TTL и чем дольше
+    запись грузится из базы, тем выше шанс перезагрузить её заранее
+    """
+    beta = settings.CACHE_EARLY_REFRESH_BETA if beta is None else beta
+    cached_until = link_data.get("cached_until")
+    if beta <= 0 or not cached_until or link_data.get("deleted"):
+        return False
+    load_time = link_data.get("load_time") or settings.CACHE_EARLY_REFRESH_MIN_LOAD_TIME
+    return time.time() - load_time * beta * math.log(1.0 - random.random()) >= cached_until
+
+@traced()
+async def cache_tombstone(short_code: str, cache: CacheBackend = None, expire: int = None):
+    expire = settings.CACHE_TOMBSTONE_TTL if expire is None else expire
+    await cache_link(short_code, tombstone_record(), expire, cache=cache)
+
+@traced()
+async def get_cached_link(short_code: str, cache: CacheBackend = None):
+    cached = local_cache.get(short_code)
+    if cached is not None:
+        observe_cache("local", "hit")
+        return cached
+    observe_cache("local", "miss")
+    cache = cache or get_cache()
+    try:
+        data = await cache.get(short_code)
+    except Exception:
+        observe_cache("shared", "error")
+        raise
     if data:
-        return json.loads(data)
+        observe_cache("shared", "hit")
+        cached = json.loads(data)
+        local_cache.set(short_code, cached, cache_ttl(cached))
+        return cached
+    observe_cache("shared", "miss")
     return None
 
-async def invalidate_cached_link(short_code: str):
-    async with aioredis.from_url(settings.REDIS_URL, decode_responses=True) as redis:
-        await redis.delete(short_code)
+@traced()
+async def publish_invalidation(short_code: str, cache: CacheBackend = None):
+    """
+    Сообщаем остальным воркерам, что их L1-запись для short_code устарела
+    """
+    cache = cache or get_cache()
+    message = json.dumps({"origin": WORKER_ID, "short_code": short_code})
+    await cache.publish(settings.CACHE_INVALIDATION_CHANNEL, message)
+
+@traced()
+async def publish_user_revocation(user_id: int, cache: CacheBackend = None):
+    """
+    Сбрасываем закэшированные токены пользователя во всех воркерах
+    """
+    principal_cache.revoke(user_id)
+    cache = cache or get_cache()
+    message = json.dumps({"origin": WORKER_ID, "revoke_user": user_id})
+    await cache.publish(settings.CACHE_INVALIDATION_CHANNEL, message)
+
+@traced()
+async def invalidate_cached_link(short_code: str, cache: CacheBackend = None):
+    cache = cache or get_cache()
+    local_cache.pop(short_code)
+    await cache.delete(short_code)
+    await publish_invalidation(short_code, cache=cache)
+
+@traced()
+async def invalidate_cached_links(short_codes, cache: CacheBackend = None):
+    """
+    Удаляет пачку записей одним DEL и одним сообщением другим воркерам
+    """
+    if not short_codes:
+        return
+    cache = cache or get_cache()
+    for short_code in short_codes:
+        local_cache.pop(short_code)
+    await cache.delete(*short_codes)
+    message = json.dumps({"origin": WORKER_ID, "short_codes": list(short_codes)})
+    await cache.publish(settings.CACHE_INVALIDATION_CHANNEL, message)
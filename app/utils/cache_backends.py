@@ -0,0 +1,241 @@
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+import aioredis
+from app.config import settings
+
+class Subscription(ABC):
+    """
+    Подписка на канал: после входа в async with сообщения уже не теряются,
+    дальше их можно читать через async for
+    """
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def __aiter__(self):
+        return self
+
+    @abstractmethod
+    async def __anext__(self) -> str:
+        ...
+
+    @abstractmethod
+    async def close(self):
+        ...
+
+class CacheBackend(ABC):
+    """
+    Минимальный интерфейс хранилища кэша: строки по ключу с TTL и pub/sub
+    """
+    name = "abstract"
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, value: str, ttl: int):
+        ...
+
+    @abstractmethod
+    async def set_many(
+        self, items: Iterable[Tuple[str, str, int]], message: Tuple[str, str] = None, only_if_absent: bool = False
+    ):
+        """
+        Записывает пачку (key, value, ttl) за один проход и, если передано,
+        публикует message = (channel, data) в том же проходе.
+        only_if_absent — как SET NX: существующие ключи не перезаписываются
+        """
+
+    @abstractmethod
+    async def delete(self, *keys: str) -> int:
+        ...
+
+    @abstractmethod
+    async def publish(self, channel: str, message: str):
+        ...
+
+    @abstractmethod
+    def subscribe(self, channel: str) -> Subscription:
+        ...
+
+    @abstractmethod
+    async def ping(self) -> bool:
+        ...
+
+    @abstractmethod
+    async def flush(self):
+        ...
+
+    async def close(self):
+        pass
+
+class RedisSubscription(Subscription):
+    def __init__(self, redis: aioredis.Redis, channel: str):
+        self._pubsub = redis.pubsub(ignore_subscribe_messages=True)
+        self._channel = channel
+
+    async def __aenter__(self):
+        await self._pubsub.subscribe(self._channel)
+        return self
+
+    async def __anext__(self) -> str:
+        while True:
+            message = await self._pubsub.get_message(timeout=1.0)
+            if message:
+                return message["data"]
+
+    async def close(self):
+        await self._pubsub.close()
+
+class RedisCacheBackend(CacheBackend):
+    name = "redis"
+
+    def __init__(self, url: str = None):
+        pool = aioredis.BlockingConnectionPool.from_url(
+            url or settings.REDIS_URL,
+            max_connections=settings.REDIS_MAX_CONNECTIONS,
+            timeout=settings.REDIS_POOL_TIMEOUT,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            decode_responses=True
+        )
+        self.redis = aioredis.Redis(connection_pool=pool)
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self.redis.get(key)
+
+    async def set(self, key: str, value: str, ttl: int):
+        await self.redis.setex(key, ttl, value)
+
+    async def set_many(self, items, message=None, only_if_absent=False):
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key, value, ttl in items:
+                pipe.set(key, value, ex=ttl, nx=only_if_absent)
+            if message is not None:
+                pipe.publish(*message)
+            await pipe.execute()
+
+    async def delete(self, *keys: str) -> int:
+        if not keys:
+            return 0
+        return await self.redis.delete(*keys)
+
+    async def publish(self, channel: str, message: str):
+        await self.redis.publish(channel, message)
+
+    def subscribe(self, channel: str) -> Subscription:
+        return RedisSubscription(self.redis, channel)
+
+    async def ping(self) -> bool:
+        return bool(await self.redis.ping())
+
+    async def flush(self):
+        await self.redis.flushdb()
+
+    async def close(self):
+        await self.redis.close()
+        await self.redis.connection_pool.disconnect()
+
+class MemorySubscription(Subscription):
+    def __init__(self, subscribers: Dict[str, Set[asyncio.Queue]], channel: str):
+        self._subscribers = subscribers
+        self._channel = channel
+        self._queue: asyncio.Queue = asyncio.Queue()
+
+    async def __aenter__(self):
+        self._subscribers.setdefault(self._channel, set()).add(self._queue)
+        return self
+
+    async def __anext__(self) -> str:
+        return await self._queue.get()
+
+    async def close(self):
+        self._subscribers.get(self._channel, set()).discard(self._queue)
+
+class MemoryCacheBackend(CacheBackend):
+    """
+    Кэш в памяти процесса: для одного процесса без Redis и для тестов.
+    Данные и pub/sub не видны другим воркерам, поэтому с WEB_CONCURRENCY > 1 не создаётся
+    """
+    name = "memory"
+
+    def __init__(self):
+        self._data: Dict[str, Tuple[float, str]] = {}
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._sets_since_purge = 0
+
+    def _purge_expired(self):
+        now = time.monotonic()
+        for key in [key for key, (expires_at, _) in self._data.items() if expires_at <= now]:
+            del self._data[key]
+
+    async def get(self, key: str) -> Optional[str]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        if item[0] <= time.monotonic():
+            del self._data[key]
+            return None
+        return item[1]
+
+    async def set(self, key: str, value: str, ttl: int):
+        max_entries = settings.MEMORY_CACHE_MAX_ENTRIES
+        # полный проход по истёкшим — не чаще раза на max_entries записей, в среднем O(1) на set
+        self._sets_since_purge += 1
+        if self._sets_since_purge >= max_entries:
+            self._sets_since_purge = 0
+            self._purge_expired()
+        if key not in self._data and len(self._data) >= max_entries:
+            # самая старая по времени записи
+            self._data.pop(next(iter(self._data)))
+        self._data.pop(key, None)
+        self._data[key] = (time.monotonic() + ttl, value)
+
+    async def set_many(self, items, message=None, only_if_absent=False):
+        for key, value, ttl in items:
+            if only_if_absent and await self.get(key) is not None:
+                continue
+            await self.set(key, value, ttl)
+        if message is not None:
+            await self.publish(*message)
+
+    async def delete(self, *keys: str) -> int:
+        return sum(self._data.pop(key, None) is not None for key in keys)
+
+    async def publish(self, channel: str, message: str):
+        for queue in list(self._subscribers.get(channel, ())):
+            queue.put_nowait(message)
+
+    def subscribe(self, channel: str) -> Subscription:
+        return MemorySubscription(self._subscribers, channel)
+
+    async def ping(self) -> bool:
+        return True
+
+    async def flush(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+BACKENDS = {
+    RedisCacheBackend.name: RedisCacheBackend,
+    MemoryCacheBackend.name: MemoryCacheBackend,
+}
+
+def create_cache_backend(name: str = None) -> CacheBackend:
+    name = name or settings.CACHE_BACKEND
+    backend_class = BACKENDS.get(name)
+    if backend_class is None:
+        raise ValueError(f"Неизвестный бэкенд кэша: {name}. Доступны: {', '.join(BACKENDS)}")
+    if backend_class is MemoryCacheBackend and settings.WEB_CONCURRENCY > 1:
+        raise ValueError(
+            f"Бэкенд кэша memory работает только в одном процессе, а WEB_CONCURRENCY={settings.WEB_CONCURRENCY}: "
+            "используйте redis"
+        )
+    return backend_class()
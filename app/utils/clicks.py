@@ -0,0 +1,122 @@
+import logging
+from collections import Counter, deque
+from datetime import datetime, timedelta, timezone
+from typing import Deque, Dict, List, Optional, Tuple
+
+from app import crud
+from app.config import settings
+from app.database import SessionLocal
+from app.utils.hll import HyperLogLog
+from app.utils.periodic import PeriodicWorker
+
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = {
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+}
+
+ClickEvent = Tuple[str, datetime, Optional[str], Optional[str], Optional[int]]
+
+def bucket_start(moment: datetime, granularity: str) -> datetime:
+    moment = moment.astimezone(timezone.utc)
+    if granularity == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"Неизвестная гранулярность: {granularity}")
+
+def rollup_clicks(events: List[ClickEvent]) -> List[Tuple[str, str, datetime, int]]:
+    """
+    Сворачивает события в приросты (short_code, granularity, bucket, clicks)
+    """
+    counts = Counter()
+    for short_code, clicked_at, _, _, _ in events:
+        for granularity in GRANULARITIES:
+            counts[short_code, granularity, bucket_start(clicked_at, granularity)] += 1
+    return [(short_code, granularity, bucket, clicks) for (short_code, granularity, bucket), clicks in counts.items()]
+
+def sketch_visitors(events: List[ClickEvent]) -> Dict[Tuple[str, datetime], HyperLogLog]:
+    """
+    Скетчи уникальных посетителей по (short_code, день)
+    """
+    sketches: Dict[Tuple[str, datetime], HyperLogLog] = {}
+    for short_code, clicked_at, _, _, visitor in events:
+        if visitor is None:
+            continue
+        key = (short_code, bucket_start(clicked_at, "day"))
+        sketch = sketches.get(key)
+        if sketch is None:
+            sketch = sketches[key] = HyperLogLog()
+        sketch.add_hash(visitor)
+    return sketches
+
+class ClickPipeline(PeriodicWorker):
+    """
+    Буфер событий переходов в памяти процесса. Обработчик редиректа только кладёт
+    событие в очередь, фоновый проход пачками пишет события и свёртки по часам и дням
+    """
+    name = "click-pipeline"
+
+    def __init__(self, session_factory=SessionLocal, interval: float = None, batch_size: int = None,
+                 max_events: int = None, enabled: bool = None):
+        super().__init__(interval or settings.CLICK_FLUSH_INTERVAL)
+        self.session_factory = session_factory
+        self.batch_size = batch_size or settings.CLICK_FLUSH_BATCH_SIZE
+        self.max_events = max_events or settings.CLICK_BUFFER_MAX_EVENTS
+        self.enabled = settings.CLICK_EVENTS_ENABLED if enabled is None else enabled
+        self._buffer: Deque[ClickEvent] = deque()
+        self.flushed = 0
+        self.dropped = 0
+
+    @staticmethod
+    def _trim(value: Optional[str]) -> Optional[str]:
+        if not value:
+            return None
+        return value[:settings.CLICK_EVENT_FIELD_MAX_LENGTH]
+
+    def record(self, short_code: str, referrer: str = None, user_agent: str = None, clicked_at: datetime = None,
+               visitor: int = None):
+        if not self.enabled:
+            return
+        if len(self._buffer) >= self.max_events:
+            # база не успевает: теряем события, но не память процесса
+            self.dropped += 1
+            return
+        self._buffer.append((
+            short_code,
+            clicked_at or datetime.now(timezone.utc),
+            self._trim(referrer),
+            self._trim(user_agent),
+            visitor
+        ))
+
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    async def flush(self) -> int:
+        flushed = 0
+        while self._buffer:
+            batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+            try:
+                async with self.session_factory() as db:
+                    await crud.store_click_events(db, batch, rollup_clicks(batch), sketch_visitors(batch))
+            except BaseException:
+                self._buffer.extendleft(reversed(batch))
+                raise
+            flushed += len(batch)
+        self.flushed += flushed
+        return flushed
+
+    async def run_once(self):
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "buffered": len(self._buffer),
+            "flushed": self.flushed,
+            "dropped": self.dropped
+        }
+
+click_pipeline = ClickPipeline()
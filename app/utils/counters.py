@@ -0,0 +1,67 @@
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from app import crud
+from app.config import settings
+from app.database import SessionLocal
+from app.utils.periodic import PeriodicWorker
+
+class RedirectCounter(PeriodicWorker):
+    """
+    Копит приросты redirect_count и последний last_accessed_at по short_code
+    в памяти процесса и пачками сбрасывает их в базу
+    """
+    name = "redirect-counter"
+
+    def __init__(self, session_factory=SessionLocal, interval: float = None, batch_size: int = None):
+        super().__init__(interval or settings.REDIRECT_FLUSH_INTERVAL)
+        self.session_factory = session_factory
+        self.batch_size = batch_size or settings.REDIRECT_FLUSH_BATCH_SIZE
+        self._pending: Dict[str, List] = {}
+
+    def record(self, short_code: str, accessed_at: datetime = None):
+        accessed_at = accessed_at or datetime.now(timezone.utc)
+        entry = self._pending.get(short_code)
+        if entry is None:
+            self._pending[short_code] = [1, accessed_at]
+        else:
+            entry[0] += 1
+            if accessed_at > entry[1]:
+                entry[1] = accessed_at
+
+    def pending(self, short_code: str) -> Tuple[int, Optional[datetime]]:
+        entry = self._pending.get(short_code)
+        if entry is None:
+            return 0, None
+        return entry[0], entry[1]
+
+    def _merge_back(self, items):
+        for short_code, (delta, accessed_at) in items:
+            entry = self._pending.setdefault(short_code, [0, accessed_at])
+            entry[0] += delta
+            if accessed_at > entry[1]:
+                entry[1] = accessed_at
+
+    async def flush(self) -> int:
+        if not self._pending:
+            return 0
+        items = list(self._pending.items())
+        self._pending = {}
+        flushed = 0
+        try:
+            for start in range(0, len(items), self.batch_size):
+                batch = items[start:start + self.batch_size]
+                async with self.session_factory() as db:
+                    await crud.apply_redirect_deltas(
+                        db, [(code, delta, accessed_at) for code, (delta, accessed_at) in batch]
+                    )
+                flushed += len(batch)
+        except BaseException:
+            self._merge_back(items[flushed:])
+            raise
+        return flushed
+
+    async def run_once(self):
+        await self.flush()
+
+redirect_counter = RedirectCounter()
@@ -0,0 +1,232 @@
+import bisect
+import json
+import logging
+import os
+import tempfile
+from typing import Dict, Iterable, List, Tuple
+
+from app.config import settings
+from app.utils.periodic import PeriodicWorker
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[str, ...]
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[Labels, object] = {}
+
+    def snapshot(self) -> list:
+        return [[list(labels), value] for labels, value in self.values.items()]
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, labels: Labels = (), amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def inc(self, labels: Labels = (), amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, labels: Labels = (), amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) - amount
+
+class Histogram(Metric):
+    """
+    Значение по меткам — [счётчики по корзинам (последняя — +Inf), сумма]
+    """
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, labels: Labels = ()):
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def snapshot(self) -> dict:
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def reset(self):
+        for metric in self.metrics.values():
+            metric.values.clear()
+
+def _merge(metric: Metric, snapshots: List[dict]) -> Dict[Labels, object]:
+    merged: Dict[Labels, object] = {}
+    for snapshot in snapshots:
+        for labels, value in snapshot.get(metric.name, ()):
+            labels = tuple(labels)
+            if isinstance(metric, Histogram):
+                entry = merged.setdefault(labels, [[0] * (len(metric.buckets) + 1), 0.0])
+                entry[0] = [a + b for a, b in zip(entry[0], value[0])]
+                entry[1] += value[1]
+            else:
+                merged[labels] = merged.get(labels, 0) + value
+    return merged
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names, values, extra: Tuple[str, str] = None) -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render(registry: MetricsRegistry, snapshots: List[dict]) -> str:
+    """
+    Текстовый формат Prometheus 0.0.4 по сумме снимков всех воркеров
+    """
+    lines = []
+    for metric in registry.metrics.values():
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for labels, value in sorted(_merge(metric, snapshots).items()):
+            if isinstance(metric, Histogram):
+                counts, total = value
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    label_text = _format_labels(metric.labelnames, labels, ("le", _format_number(float(bound))))
+                    lines.append(f"{metric.name}_bucket{label_text} {cumulative}")
+                label_text = _format_labels(metric.labelnames, labels)
+                lines.append(f"{metric.name}_sum{label_text} {_format_number(total)}")
+                lines.append(f"{metric.name}_count{label_text} {cumulative}")
+            else:
+                lines.append(f"{metric.name}{_format_labels(metric.labelnames, labels)} {_format_number(value)}")
+    return "\n".join(lines) + "\n"
+
+class MultiprocessExporter(PeriodicWorker):
+    """
+    При нескольких воркерах каждый раз в interval секунд пишет свой снимок
+    в METRICS_MULTIPROC_DIR/<pid>.json, а /metrics складывает снимки всех воркеров.
+    Счётчики завершившихся воркеров продолжают учитываться, их gauge — нет
+    """
+    name = "metrics-exporter"
+
+    def __init__(self, registry: MetricsRegistry, directory: str = None, interval: float = None):
+        super().__init__(interval or settings.METRICS_FLUSH_INTERVAL)
+        self.registry = registry
+        self.directory = settings.METRICS_MULTIPROC_DIR if directory is None else directory
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory)
+
+    def _path(self, pid: int) -> str:
+        return os.path.join(self.directory, f"{pid}.json")
+
+    def write(self):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.registry.snapshot(), f)
+        os.replace(tmp_path, self._path(os.getpid()))
+
+    @staticmethod
+    def _alive(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def collect(self) -> List[dict]:
+        if not self.enabled:
+            return [self.registry.snapshot()]
+        self.write()
+        snapshots = []
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, filename)) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                logger.warning("Не удалось прочитать снимок метрик %s", filename)
+                continue
+            if not self._alive(int(filename[:-len(".json")])):
+                snapshot = {
+                    name: values for name, values in snapshot.items()
+                    if not isinstance(self.registry.metrics.get(name), Gauge)
+                }
+            snapshots.append(snapshot)
+        return snapshots
+
+    async def run_once(self):
+        if self.enabled:
+            self.write()
+
+    def render(self) -> str:
+        return render(self.registry, self.collect())
+
+registry = MetricsRegistry()
+
+http_requests = registry.register(Counter(
+    "shorturler_http_requests_total", "HTTP-запросы по маршруту и коду ответа", ("method", "route", "status")
+))
+http_request_duration = registry.register(Histogram(
+    "shorturler_http_request_duration_seconds", "Время обработки HTTP-запроса", ("method", "route")
+))
+http_in_flight = registry.register(Gauge(
+    "shorturler_http_requests_in_flight", "HTTP-запросы в обработке"
+))
+cache_requests = registry.register(Counter(
+    "shorturler_cache_requests_total", "Обращения к кэшу ссылок по уровню и результату", ("layer", "result")
+))
+db_queries = registry.register(Counter(
+    "shorturler_db_queries_total", "SQL-запросы по типу", ("statement",)
+))
+db_query_duration = registry.register(Histogram(
+    "shorturler_db_query_duration_seconds", "Время выполнения SQL-запроса", ("statement",)
+))
+
+metrics_exporter = MultiprocessExporter(registry)
+
+def statement_type(statement: str) -> str:
+    keyword = statement.lstrip().split(None, 1)[0].lower() if statement.strip() else ""
+    return keyword if keyword in ("select", "insert", "update", "delete") else "other"
+
+def observe_query(statement: str, duration: float):
+    if not settings.METRICS_ENABLED:
+        return
+    labels = (statement_type(statement),)
+    db_queries.inc(labels)
+    db_query_duration.observe(duration, labels)
+
+def observe_cache(layer: str, result: str):
+    if settings.METRICS_ENABLED:
+        cache_requests.inc((layer, result))
+
+def observe_request(method: str, route: str, status: int, duration: float):
+    http_requests.inc((method, route, str(status)))
+    http_request_duration.observe(duration, (method, route))
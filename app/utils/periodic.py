@@ -0,0 +1,50 @@
+import asyncio
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+class PeriodicWorker:
+    """
+    Фоновая задача, которая раз в interval секунд вызывает run_once().
+    При остановке выполняет последний проход, чтобы ничего не потерять
+    """
+    name = "periodic-worker"
+    # нужен ли последний проход при остановке
+    drain_on_stop = True
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def run_once(self):
+        raise NotImplementedError
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("%s: ошибка фонового прохода", self.name)
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if not self.running:
+            self._task = asyncio.create_task(self._loop(), name=self.name)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.drain_on_stop:
+            await self.run_once()
@@ -0,0 +1,56 @@
+import time
+from collections import OrderedDict
+
+from app.config import settings
+
+class PrincipalCache:
+    """
+    Проверенные токены -> пользователь. Запись живёт не дольше самого токена
+    и удаляется сразу при смене пароля или удалении аккаунта
+    """
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.revocations = 0
+
+    def get(self, token: str):
+        item = self._data.get(token)
+        if item is None or item[0] <= time.time():
+            if item is not None:
+                del self._data[token]
+            self.misses += 1
+            return None
+        self._data.move_to_end(token)
+        self.hits += 1
+        return item[1]
+
+    def set(self, token: str, principal, token_expires_at: float):
+        if self.max_entries <= 0:
+            return
+        expires_at = min(time.time() + self.ttl, token_expires_at)
+        self._data[token] = (expires_at, principal)
+        self._data.move_to_end(token)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def revoke(self, user_id: int):
+        for token in [token for token, (_, principal) in self._data.items() if principal.id == user_id]:
+            del self._data[token]
+        self.revocations += 1
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "revocations": self.revocations
+        }
+
+principal_cache = PrincipalCache(settings.PRINCIPAL_CACHE_MAX_ENTRIES, settings.PRINCIPAL_CACHE_TTL)
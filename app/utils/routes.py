@@ -0,0 +1,7 @@
+# Постоянные первые сегменты путей под /links/: короткий код с таким именем был бы недостижим.
+# Схемы, fast path и роутер берут их отсюда, роутер при импорте проверяет, что список полон
+RESERVED_SHORT_CODES = frozenset({"shorten", "search", "trending"})
+
+def static_segments(routes) -> frozenset:
+    segments = (route.path.strip("/").split("/", 1)[0] for route in routes)
+    return frozenset(segment for segment in segments if segment and not segment.startswith("{"))
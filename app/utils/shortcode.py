@@ -0,0 +1,114 @@
+import asyncio
+import math
+from typing import List
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import models
+from app.config import settings
+
+# Простое число для перемешивания последовательных id по пространству кодов,
+# чтобы соседние ссылки не получали соседние коды
+PERMUTATION_MULTIPLIER = 2_654_435_761
+
+class ShortCodeEncoder:
+    """
+    Взаимно однозначно переводит целый id в код: prefix + length символов алфавита.
+    id, не помещающиеся в length символов, получают коды длиннее, поэтому коллизий нет
+    """
+    def __init__(self, alphabet: str = None, length: int = None, prefix: str = None):
+        self.alphabet = alphabet or settings.SHORT_CODE_ALPHABET
+        self.length = length or settings.SHORT_CODE_LENGTH
+        self.prefix = settings.SHORT_CODE_PREFIX if prefix is None else prefix
+        if len(set(self.alphabet)) != len(self.alphabet) or len(self.alphabet) < 2:
+            raise ValueError("Алфавит коротких кодов должен состоять минимум из двух разных символов")
+        self.base = len(self.alphabet)
+        self.space = self.base ** self.length
+        self.multiplier = PERMUTATION_MULTIPLIER
+        while math.gcd(self.multiplier, self.space) != 1:
+            self.multiplier += 2
+
+    def _digits(self, value: int, width: int) -> str:
+        chars = []
+        while value or len(chars) < width:
+            value, rem = divmod(value, self.base)
+            chars.append(self.alphabet[rem])
+        return "".join(reversed(chars))
+
+    def encode(self, value: int) -> str:
+        if value < 0:
+            raise ValueError("id короткого кода не может быть отрицательным")
+        if value < self.space:
+            return self.prefix + self._digits(value * self.multiplier % self.space, self.length)
+        return self.prefix + self._digits(value, self.length + 1)
+
+    def is_generated(self, code: str) -> bool:
+        """
+        Код выглядит как сгенерированный — такой алиас мог бы столкнуться с будущим кодом
+        """
+        if not code.startswith(self.prefix):
+            return False
+        body = code[len(self.prefix):]
+        return len(body) >= self.length and all(ch in self.alphabet for ch in body)
+
+class ShortCodeAllocator:
+    """
+    Выдаёт уникальные id для кодов из блоков, зарезервированных в таблице short_code_counters.
+    Обращение к базе нужно один раз на блок, а не на каждую ссылку
+    """
+    def __init__(self, block_size: int = None, counter_name: str = "links"):
+        self.block_size = block_size or settings.SHORT_CODE_BLOCK_SIZE
+        self.counter_name = counter_name
+        self._next = 0
+        self._end = 0
+        self._lock = asyncio.Lock()
+        self.reservations = 0
+
+    async def _reserve(self, db: AsyncSession, size: int):
+        counters = models.ShortCodeCounter.__table__
+        condition = counters.c.name == self.counter_name
+        while True:
+            result = await db.execute(
+                update(counters).where(condition).values(next_value=counters.c.next_value + size)
+            )
+            if result.rowcount:
+                end = (await db.execute(select(counters.c.next_value).where(condition))).scalar()
+                break
+            try:
+                await db.execute(insert(counters).values(name=self.counter_name, next_value=1 + size))
+                end = 1 + size
+                break
+            except IntegrityError:
+                # счётчик одновременно создал другой воркер
+                await db.rollback()
+        # резерв фиксируем сразу: откат вставки ссылки не должен вернуть блок в общий пул
+        await db.commit()
+        self._next, self._end = end - size, end
+        self.reservations += 1
+
+    def reset(self):
+        """
+        Забыть остаток блока (например, при переключении на другую базу)
+        """
+        self._next = self._end = 0
+
+    async def allocate_many(self, db: AsyncSession, count: int) -> List[int]:
+        ids: List[int] = []
+        while len(ids) < count:
+            if self._next >= self._end:
+                async with self._lock:
+                    if self._next >= self._end:
+                        await self._reserve(db, max(self.block_size, count - len(ids)))
+                continue
+            take = min(count - len(ids), self._end - self._next)
+            ids.extend(range(self._next, self._next + take))
+            self._next += take
+        return ids
+
+    async def allocate(self, db: AsyncSession) -> int:
+        return (await self.allocate_many(db, 1))[0]
+
+short_code_encoder = ShortCodeEncoder()
+short_code_allocator = ShortCodeAllocator()
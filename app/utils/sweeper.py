@@ -0,0 +1,84 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+from app import crud
+from app.config import settings
+from app.database import SessionLocal
+from app.utils.bloom import short_code_filter
+from app.utils.cache import get_cache, invalidate_cached_links
+from app.utils.periodic import PeriodicWorker
+from app.utils.trending import trending_links
+
+logger = logging.getLogger(__name__)
+
+class ExpiredLinkSweeper(PeriodicWorker):
+    """
+    Удаляет ссылки, истёкшие больше EXPIRED_SWEEP_GRACE секунд назад (до этого
+    они отдают 410), пачками по batch_size с паузой между ними, чтобы не держать
+    долгих блокировок на links
+    """
+    name = "expired-link-sweeper"
+    drain_on_stop = False
+
+    def __init__(self, session_factory=SessionLocal, interval: float = None, batch_size: int = None,
+                 max_batches: int = None, pause: float = None, enabled: bool = None):
+        super().__init__(interval or settings.EXPIRED_SWEEP_INTERVAL)
+        self.session_factory = session_factory
+        self.batch_size = batch_size or settings.EXPIRED_SWEEP_BATCH_SIZE
+        self.max_batches = max_batches or settings.EXPIRED_SWEEP_MAX_BATCHES
+        self.pause = settings.EXPIRED_SWEEP_PAUSE if pause is None else pause
+        self.enabled = settings.EXPIRED_SWEEP_ENABLED if enabled is None else enabled
+        self.passes = 0
+        self.deleted = 0
+        self.last_pass_deleted = 0
+        self.last_pass_seconds = 0.0
+
+    async def sweep(self, now: datetime = None) -> int:
+        now = now or datetime.now(timezone.utc)
+        expired_before = now - timedelta(seconds=settings.EXPIRED_SWEEP_GRACE)
+        started = time.perf_counter()
+        deleted = 0
+        for batch in range(self.max_batches):
+            if batch and self.pause:
+                await asyncio.sleep(self.pause)
+            async with self.session_factory() as db:
+                short_codes = await crud.delete_expired_links(db, expired_before, self.batch_size)
+            if not short_codes:
+                break
+            await invalidate_cached_links(short_codes, cache=get_cache())
+            for short_code in short_codes:
+                short_code_filter.remove(short_code)
+                trending_links.discard(short_code)
+            deleted += len(short_codes)
+            if len(short_codes) < self.batch_size:
+                break
+
+        self.passes += 1
+        self.deleted += deleted
+        self.last_pass_deleted = deleted
+        self.last_pass_seconds = time.perf_counter() - started
+        if deleted:
+            logger.info(
+                "Удалено истёкших ссылок: %d за %.2f с (%.0f в секунду)",
+                deleted, self.last_pass_seconds, deleted / self.last_pass_seconds
+            )
+        return deleted
+
+    async def run_once(self):
+        if self.enabled:
+            await self.sweep()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "passes": self.passes,
+            "deleted": self.deleted,
+            "last_pass_deleted": self.last_pass_deleted,
+            "last_pass_seconds": round(self.last_pass_seconds, 3),
+            "last_pass_rows_per_second": round(self.last_pass_deleted / self.last_pass_seconds, 1)
+            if self.last_pass_seconds else 0.0
+        }
+
+expired_link_sweeper = ExpiredLinkSweeper()
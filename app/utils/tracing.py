@@ -0,0 +1,126 @@
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+from typing import Deque, List, Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+class RequestTrace:
+    """
+    Отрезки времени одного HTTP-запроса: (имя, начало от старта запроса, длительность, вложенность)
+    """
+    __slots__ = ("started", "spans", "depth")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans: List[tuple] = []
+        self.depth = 0
+
+    def add(self, name: str, started: float, duration: float, depth: int = None):
+        self.spans.append((name, started - self.started, duration, self.depth if depth is None else depth))
+
+    def to_dict(self) -> List[dict]:
+        return [
+            {"name": name, "start_ms": round(start * 1000, 3), "duration_ms": round(duration * 1000, 3), "depth": depth}
+            for name, start, duration, depth in sorted(self.spans, key=lambda item: item[1])
+        ]
+
+request_trace: ContextVar[Optional[RequestTrace]] = ContextVar("request_trace", default=None)
+
+class span:
+    """
+    with span("name"): ... — отрезок попадает в трассу текущего запроса, если она включена
+    """
+    __slots__ = ("name", "trace", "started")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.trace = request_trace.get()
+
+    def __enter__(self):
+        if self.trace is not None:
+            self.started = time.perf_counter()
+            self.trace.depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.trace is not None:
+            self.trace.depth -= 1
+            self.trace.add(self.name, self.started, time.perf_counter() - self.started)
+
+def traced(name: str = None):
+    """
+    Декоратор корутины: без активной трассы почти ничего не стоит
+    """
+    def decorator(fn):
+        span_name = name or f"{fn.__module__.rsplit('.', 1)[-1]}.{fn.__name__}"
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            if request_trace.get() is None:
+                return await fn(*args, **kwargs)
+            with span(span_name):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+slow_traces: Deque[dict] = deque(maxlen=settings.TRACE_KEEP_LAST)
+
+def report_slow_request(method: str, path: str, status: int, trace: RequestTrace):
+    duration = time.perf_counter() - trace.started
+    if duration * 1000 < settings.TRACE_SLOW_REQUEST_MS:
+        return
+    record = {
+        "method": method,
+        "path": path,
+        "status": status,
+        "duration_ms": round(duration * 1000, 3),
+        "spans": trace.to_dict(),
+    }
+    slow_traces.append(record)
+    logger.warning("Медленный запрос: %s", json.dumps(record, ensure_ascii=False))
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class SamplingProfiler:
+    """
+    Раз в interval секунд снимает стек потока с event loop из отдельного потока.
+    Результат — collapsed stacks (формат flamegraph.pl / speedscope): "a;b;c число"
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    def profile(self, thread_id: int, seconds: float, interval: float) -> str:
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("Профилирование уже идёт")
+        try:
+            stacks = Counter()
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                frame = sys._current_frames().get(thread_id)
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                if stack:
+                    stacks[";".join(reversed(stack))] += 1
+                time.sleep(interval)
+        finally:
+            self._lock.release()
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+sampling_profiler = SamplingProfiler()
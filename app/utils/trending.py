@@ -0,0 +1,123 @@
+import heapq
+import math
+import re
+import time
+from typing import Dict, List, Tuple
+
+from app.config import settings
+
+WINDOW_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+# после такого показателя степени веса пересчитываются, чтобы не уйти в inf
+RENORMALIZE_EXPONENT = 50.0
+
+def parse_window(window: str) -> float:
+    match = re.fullmatch(r"(\d+)([smhd])", window.strip())
+    if not match:
+        raise ValueError(f"Некорректное окно: {window}")
+    return int(match.group(1)) * WINDOW_UNITS[match.group(2)]
+
+class SpaceSaving:
+    """
+    Top-K по алгоритму Space-Saving с прямым экспоненциальным затуханием:
+    не больше capacity счётчиков, каждый клик весит exp((t - landmark) / tau),
+    поэтому старые клики плавно теряют вес без прохода по всем счётчикам
+    """
+    def __init__(self, capacity: int, tau: float, landmark: float = None):
+        self.capacity = capacity
+        self.tau = tau
+        self.landmark = time.monotonic() if landmark is None else landmark
+        self._counts: Dict[str, float] = {}
+        self._errors: Dict[str, float] = {}
+        # ленивая min-куча: устаревшие пары (count, key) отбрасываются при извлечении
+        self._heap: List[Tuple[float, str]] = []
+
+    def _rebuild_heap(self):
+        self._heap = [(count, key) for key, count in self._counts.items()]
+        heapq.heapify(self._heap)
+
+    def _renormalize(self, now: float):
+        scale = math.exp(-(now - self.landmark) / self.tau)
+        self._counts = {key: count * scale for key, count in self._counts.items()}
+        self._errors = {key: error * scale for key, error in self._errors.items()}
+        self.landmark = now
+        self._rebuild_heap()
+
+    def _pop_min(self) -> Tuple[float, str]:
+        while True:
+            count, key = heapq.heappop(self._heap)
+            if self._counts.get(key) == count:
+                return count, key
+
+    def add(self, key: str, now: float = None):
+        now = time.monotonic() if now is None else now
+        if (now - self.landmark) / self.tau > RENORMALIZE_EXPONENT:
+            self._renormalize(now)
+        weight = math.exp((now - self.landmark) / self.tau)
+
+        if key in self._counts:
+            count = self._counts[key] + weight
+        elif len(self._counts) < self.capacity:
+            count = weight
+            self._errors[key] = 0.0
+        else:
+            floor, evicted = self._pop_min()
+            del self._counts[evicted]
+            del self._errors[evicted]
+            count = floor + weight
+            self._errors[key] = floor
+        self._counts[key] = count
+        heapq.heappush(self._heap, (count, key))
+        if len(self._heap) > 4 * self.capacity:
+            self._rebuild_heap()
+
+    def discard(self, key: str):
+        if self._counts.pop(key, None) is not None:
+            del self._errors[key]
+
+    def top(self, limit: int, now: float = None) -> List[Tuple[str, float, float]]:
+        """
+        (key, оценка, максимальная переоценка) в единицах «кликов с весом на момент now».
+        Проход по всем счётчикам: их не больше capacity, а top вызывается на чтение, не на каждый клик
+        """
+        now = time.monotonic() if now is None else now
+        scale = math.exp(-(now - self.landmark) / self.tau)
+        best = heapq.nlargest(limit, self._counts.items(), key=lambda item: item[1])
+        return [(key, count * scale, self._errors[key] * scale) for key, count in best]
+
+    def __len__(self):
+        return len(self._counts)
+
+class TrendingLinks:
+    """
+    Горячие short_code по каждому окну из TRENDING_WINDOWS. Данные только этого воркера
+    """
+    def __init__(self, windows: str = None, capacity: int = None):
+        windows = windows or settings.TRENDING_WINDOWS
+        capacity = capacity or settings.TRENDING_CAPACITY
+        self._sketches = {
+            window.strip(): SpaceSaving(capacity, parse_window(window))
+            for window in windows.split(",") if window.strip()
+        }
+
+    @property
+    def windows(self) -> List[str]:
+        return list(self._sketches)
+
+    def record(self, short_code: str):
+        now = time.monotonic()
+        for sketch in self._sketches.values():
+            sketch.add(short_code, now)
+
+    def discard(self, short_code: str):
+        for sketch in self._sketches.values():
+            sketch.discard(short_code)
+
+    def top(self, window: str, limit: int) -> List[Tuple[str, float, float]]:
+        if window not in self._sketches:
+            raise KeyError(window)
+        return self._sketches[window].top(limit)
+
+    def stats(self) -> dict:
+        return {window: {"tracked": len(sketch), "capacity": sketch.capacity} for window, sketch in self._sketches.items()}
+
+trending_links = TrendingLinks()
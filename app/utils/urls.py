@@ -0,0 +1,32 @@
+import hashlib
+from urllib.parse import urlsplit, urlunsplit
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+def normalize_url(url: str) -> str:
+    """
+    Приводит URL к каноническому виду: схема и хост в нижнем регистре,
+    без порта по умолчанию и без фрагмента. Неразборчивый URL (например, с портом
+    вне диапазона) возвращается как есть: такой ссылки в базе быть не может
+    """
+    url = str(url).strip()
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if ":" in host:
+        # IPv6: hostname отдаёт адрес без скобок
+        host = f"[{host}]"
+    netloc = host
+    if parts.username:
+        userinfo = parts.username + (f":{parts.password}" if parts.password else "")
+        netloc = f"{userinfo}@{host}"
+    if port and port != DEFAULT_PORTS.get(scheme):
+        netloc = f"{netloc}:{port}"
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, ""))
+
+def url_hash(url: str) -> str:
+    return hashlib.sha256(normalize_url(url).encode()).hexdigest()
@@ -0,0 +1,75 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from app import crud
+from app.config import settings
+from app.database import SessionLocal
+from app.utils.cache import cache_links, get_cache, link_cache_record
+
+logger = logging.getLogger(__name__)
+
+class CacheWarmer:
+    """
+    Прогрев кэша при старте воркера: CACHE_WARMUP_LINKS самых востребованных ссылок
+    пачками через set_many. Пока прогрев не закончился, воркер не готов (/ready отдаёт 503)
+    """
+    def __init__(self, session_factory=SessionLocal, limit: int = None, enabled: bool = None):
+        self.session_factory = session_factory
+        self.limit = settings.CACHE_WARMUP_LINKS if limit is None else limit
+        self.enabled = settings.CACHE_WARMUP_ENABLED if enabled is None else enabled
+        self.ready = False
+        self.warmed = 0
+        self.seconds = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def warm(self) -> int:
+        started = time.perf_counter()
+        warmed = 0
+        if self.enabled and self.limit > 0:
+            async with self.session_factory() as db:
+                links = await crud.get_links_for_warmup(db, self.limit)
+            cache = get_cache()
+            batch_size = settings.CACHE_WARMUP_BATCH_SIZE
+            for start in range(0, len(links), batch_size):
+                batch = links[start:start + batch_size]
+                # другие воркеры об этих записях не предупреждаем: в базе ничего не менялось.
+                # Только отсутствующие ключи: удаление или правка, прошедшие после нашего снимка, важнее
+                await cache_links(
+                    {link.short_code: link_cache_record(link) for link in batch},
+                    cache=cache, notify=False, only_if_absent=True
+                )
+                warmed += len(batch)
+        self.warmed = warmed
+        self.seconds = time.perf_counter() - started
+        logger.info("Кэш прогрет: %d ссылок за %.2f с", warmed, self.seconds)
+        return warmed
+
+    async def _run(self):
+        try:
+            await asyncio.wait_for(self.warm(), settings.CACHE_WARMUP_TIMEOUT)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # холодный кэш лучше, чем воркер, который никогда не станет готовым
+            logger.exception("Прогрев кэша не удался, продолжаем с холодным кэшем")
+        self.ready = True
+
+    def start(self):
+        self.ready = False
+        self._task = asyncio.create_task(self._run(), name="cache-warmup")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "ready": self.ready, "warmed": self.warmed, "seconds": round(self.seconds, 3)}
+
+cache_warmer = CacheWarmer()